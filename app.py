@@ -1,6 +1,9 @@
 # Standard Imports
+import os
+import hmac
 import logging
 import tornado
+import tracemalloc
 from copy import deepcopy
 
 # Third Party Imports
@@ -8,22 +11,38 @@ from copy import deepcopy
 # Internal Imports
 from components.detection import detection
 from components.embeddings import represent
+from components.result_cache import result_cache
+from stores.embedding_cache import embedding_cache
 from models.model_holder import ModelHolder
 from stores.store_holder import StoreHolder
 from configurations.config import app_config
 from components.verification import verification, recognize
 from components.operations import add_images_to_image_store
-from constants.constants import DEFAULT_RECOGNITION_RESPONSE
-
-PORT = 8000
+from constants.constants import DEFAULT_RECOGNITION_RESPONSE, NEAREST_SEARCH
+from utils.profiler import sample_threads, check_profile_arguments
+from utils.utils import process_rss_bytes, tracemalloc_top
+from utils.tracing import start_trace, span, log_slow_request, slow_request_logger
+from utils.metrics import (
+    REGISTRY,
+    current_endpoint,
+    HTTP_REQUESTS,
+    HTTP_LATENCY,
+    STORE_NTOTAL,
+    STORE_METADATA_COUNT,
+    STORE_DUMP_DURATION,
+)
+
+PORT = int(os.environ.get("PORT", 8000))
 TMP_DIR = "/tmp"
 
 
 class BaseHandler(tornado.web.RequestHandler):
 
     async def post(self):
+        current_endpoint.set(self.request.path)
+        self._trace = start_trace(self.request.path)
         try:
-            if self.request.body == b'':
+            if self.request.body == b"":
                 payloads = self.request.body
             else:
                 payloads = tornado.escape.json_decode(self.request.body)
@@ -33,11 +52,120 @@ class BaseHandler(tornado.web.RequestHandler):
             )
 
         results = await self._process_payload(payloads)
-        return self.write({"results": results})
+        with span("json_encode"):
+            response = tornado.escape.json_encode({"results": results})
+        self.set_header("Server-Timing", self._trace.server_timing())
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        return self.write(response)
 
     async def _process_payload(self, payloads):
         raise NotImplementedError()
 
+    def on_finish(self):
+        HTTP_REQUESTS.inc(endpoint=self.request.path, status=str(self.get_status()))
+        HTTP_LATENCY.observe(self.request.request_time(), endpoint=self.request.path)
+        if getattr(self, "_trace", None) is not None:
+            log_slow_request(
+                self._trace,
+                app_config.tracing.slow_request_threshold_ms,
+                status=self.get_status(),
+            )
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        for store_name, store in StoreHolder.get_stores().items():
+            stats = store.stats()
+            STORE_NTOTAL.set(stats["ntotal"], store=store_name)
+            STORE_METADATA_COUNT.set(stats["metadata_count"], store=store_name)
+            STORE_DUMP_DURATION.set(stats["last_dump_seconds"], store=store_name)
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(REGISTRY.render())
+
+
+class AdminHandler(tornado.web.RequestHandler):
+
+    def prepare(self):
+        token = app_config.admin.token
+        if not token:
+            raise tornado.web.HTTPError(
+                status_code=403, log_message="Admin endpoints are disabled"
+            )
+        authorization = self.request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+            raise tornado.web.HTTPError(
+                status_code=401, log_message="Invalid admin token"
+            )
+
+
+class ProfileHandler(AdminHandler):
+
+    async def get(self):
+        try:
+            seconds = float(self.get_argument("seconds", "10"))
+            interval = float(self.get_argument("interval_ms", "10")) / 1000
+            check_profile_arguments(seconds, interval)
+        except ValueError as e:
+            raise tornado.web.HTTPError(status_code=400, log_message=str(e))
+        output_format = self.get_argument("format", "collapsed")
+        if output_format not in ["collapsed", "speedscope"]:
+            raise tornado.web.HTTPError(
+                status_code=400, log_message=f"Unknown profile format {output_format}"
+            )
+
+        # sampled from an executor thread so the io loop keeps serving the traffic being profiled
+        try:
+            profile = await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, sample_threads, seconds, interval
+            )
+        except Exception as e:
+            raise tornado.web.HTTPError(status_code=409, log_message=str(e))
+
+        if output_format == "speedscope":
+            self.set_header("Content-Type", "application/json; charset=UTF-8")
+            self.write(tornado.escape.json_encode(profile.to_speedscope()))
+        else:
+            self.set_header("Content-Type", "text/plain; charset=utf-8")
+            self.write(profile.to_collapsed())
+
+
+class MemoryHandler(AdminHandler):
+
+    def get(self):
+        try:
+            top = int(self.get_argument("top", "20"))
+        except ValueError as e:
+            raise tornado.web.HTTPError(status_code=400, log_message=str(e))
+        if top < 0:
+            raise tornado.web.HTTPError(
+                status_code=400, log_message=f"top should not be negative, got {top}"
+            )
+
+        models = {}
+        for model_name, model in ModelHolder.get_models().items():
+            models[model_name] = {"bytes": model.memory_bytes()}
+
+        stores = {}
+        for store_name, store in StoreHolder.get_stores().items():
+            stores[store_name] = store.memory_stats()
+
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(
+            tornado.escape.json_encode(
+                {
+                    "rss_bytes": process_rss_bytes(),
+                    "models": models,
+                    "stores": stores,
+                    "caches": {
+                        result_cache.name: result_cache.stats(),
+                        embedding_cache.name: embedding_cache.stats(),
+                    },
+                    "tracemalloc": tracemalloc_top(top),
+                }
+            )
+        )
+
 
 class AddHandler(BaseHandler):
 
@@ -96,6 +224,7 @@ class RecognitionHandler(BaseHandler):
                 embedding_name=app_config.embedding_model.name,
                 store_name=app_config.image_store.store_name,
                 detector_name=app_config.detector_model.name,
+                search_mode=payloads.get("searchMode", NEAREST_SEARCH),
                 **app_config.detector_model.arguments,
             )
         except Exception as e:
@@ -162,7 +291,12 @@ class ReIndexingHandler(BaseHandler):
                 builder_name=app_config.image_store.builder_name,
                 store_path=app_config.database_path,
                 load=True,
-                rebuild=True,
+                # rebuild false keeps stored faces, e.g. to only add embeddings of a new model
+                rebuild=(
+                    payloads.get("rebuild", True)
+                    if isinstance(payloads, dict)
+                    else True
+                ),
                 **app_config.image_store.arguments,
             )
             logging.info("Successfully loaded image metadata")
@@ -214,10 +348,8 @@ def app_initializer():
             raise Exception(f"Error in loading image store: {str(e)}")
 
 
-def main():
-    logging.basicConfig(level=logging.INFO)
-    app_initializer()
-    application = tornado.web.Application(
+def make_application() -> tornado.web.Application:
+    return tornado.web.Application(
         handlers=[
             (r"/add", AddHandler),
             (r"/verify", VerifyHandler),
@@ -225,8 +357,23 @@ def main():
             (r"/face-detect", FaceDetectionHandler),
             (r"/represent", FaceRepresentationHandler),
             (r"/re-index", ReIndexingHandler),
+            (r"/metrics", MetricsHandler),
+            (r"/debug/profile", ProfileHandler),
+            (r"/debug/memory", MemoryHandler),
         ]
     )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if app_config.tracing.slow_request_log_path:
+        slow_request_logger.addHandler(
+            logging.FileHandler(app_config.tracing.slow_request_log_path)
+        )
+    if app_config.admin.tracemalloc_frames > 0:
+        tracemalloc.start(app_config.admin.tracemalloc_frames)
+    app_initializer()
+    application = make_application()
     application.listen(PORT)
     logging.info(f"Starting Application at: {PORT}")
     tornado.ioloop.IOLoop.current().start()
@@ -0,0 +1,143 @@
+# Standard Imports
+import io
+import base64
+from typing import List, Tuple
+
+# Third Party Imports
+import cv2
+import numpy as np
+from PIL import Image as pilImage
+
+# Internal Imports
+
+
+def synthetic_faces(
+    count: int, resolution: Tuple[int, int], faces_per_image=1, seed=0
+) -> Tuple[List[np.ndarray], List[List[Tuple[int, int, int, int]]]]:
+    """
+    Generates a deterministic corpus of RGB images with drawn face like patterns
+    (head, eyes, nose and mouth) on a noisy background.
+    Args:
+        count (int): number of images
+        resolution (tuple): (width, height) of every image
+        faces_per_image (int): number of faces drawn on each image
+        seed (int): random seed, same seed always produces the same corpus
+    Returns:
+        images (List[np.ndarray]): uint8 RGB images
+        boxes (List[List[tuple]]): (x, y, w, h) of every drawn face per image
+    """
+    rng = np.random.default_rng(seed)
+    width, height = resolution
+    images, boxes = [], []
+    for _ in range(count):
+        image = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        image = cv2.GaussianBlur(image, (0, 0), sigmaX=3)
+        image_boxes = []
+        for _ in range(faces_per_image):
+            face_h = int(rng.uniform(0.2, 0.5) * min(width, height) / faces_per_image)
+            face_w = int(face_h * 0.75)
+            x = int(rng.uniform(0, width - face_w))
+            y = int(rng.uniform(0, height - face_h))
+            _draw_face(image, x, y, face_w, face_h, rng)
+            image_boxes.append((x, y, face_w, face_h))
+        images.append(image)
+        boxes.append(image_boxes)
+    return images, boxes
+
+
+def _draw_face(image, x, y, w, h, rng):
+    skin = tuple(int(c) for c in rng.integers([150, 100, 80], [255, 200, 170]))
+    center = (x + w // 2, y + h // 2)
+    cv2.ellipse(image, center, (w // 2, h // 2), 0, 0, 360, skin, -1)
+
+    eye_y = y + int(h * 0.4)
+    eye_radius = max(1, w // 12)
+    for eye_x in (x + int(w * 0.3), x + int(w * 0.7)):
+        cv2.circle(image, (eye_x, eye_y), eye_radius, (255, 255, 255), -1)
+        cv2.circle(image, (eye_x, eye_y), max(1, eye_radius // 2), (40, 30, 20), -1)
+
+    cv2.line(
+        image,
+        (center[0], eye_y),
+        (center[0], y + int(h * 0.62)),
+        (120, 80, 60),
+        max(1, w // 40),
+    )
+    cv2.ellipse(
+        image,
+        (center[0], y + int(h * 0.75)),
+        (w // 5, h // 16),
+        0,
+        0,
+        180,
+        (150, 40, 40),
+        max(1, w // 30),
+    )
+
+
+def crop_faces(images, boxes) -> List[np.ndarray]:
+    """
+    Crops drawn faces in the same uint8 format detection hands to embedding models.
+    """
+    crops = []
+    for image, image_boxes in zip(images, boxes):
+        for x, y, w, h in image_boxes:
+            crops.append(image[y : y + h, x : x + w])
+    return crops
+
+
+def encode_images(images: List[np.ndarray], image_format="JPEG", quality=90):
+    """
+    Encodes images as base64 strings, the same payload format served by the api.
+    """
+    encoded = []
+    for image in images:
+        buffer = io.BytesIO()
+        pilImage.fromarray(image).save(buffer, format=image_format, quality=quality)
+        encoded.append(base64.b64encode(buffer.getvalue()).decode("utf-8"))
+    return encoded
+
+
+def synthetic_embeddings(count: int, dimension: int, clusters=None, seed=0):
+    """
+    Generates deterministic float32 embeddings, optionally grouped around cluster
+    centers to mimic multiple images per identity.
+    Args:
+        count (int): number of embeddings
+        dimension (int): embedding dimension
+        clusters (int): number of identities, None for uniformly random embeddings
+        seed (int): random seed
+    Returns:
+        embeddings (np.ndarray): (count, dimension) float32 embeddings
+        labels (np.ndarray): (count,) cluster of every embedding, None without clusters
+    """
+    rng = np.random.default_rng(seed)
+    if clusters is None:
+        return rng.standard_normal((count, dimension), dtype=np.float32), None
+
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    embeddings = centers[labels] + 0.35 * rng.standard_normal(
+        (count, dimension), dtype=np.float32
+    )
+    return embeddings.astype(np.float32), labels
+
+
+def clustered_embedding_chunks(
+    count: int, dimension: int, clusters: int, chunk_size=100000, start=0, seed=0
+):
+    """
+    Yields deterministic clustered float32 embeddings in chunks, so galleries of
+    millions of vectors never have to be materialised at once. Every embedding
+    depends only on (seed, position), embeddings from start=count onwards are
+    fresh samples of the same identities and can be used as queries.
+    """
+    centers = np.random.default_rng(seed).standard_normal(
+        (clusters, dimension), dtype=np.float32
+    )
+    for chunk_start in range(start, start + count, chunk_size):
+        size = min(chunk_size, start + count - chunk_start)
+        rng = np.random.default_rng((seed, chunk_start))
+        labels = rng.integers(0, clusters, size=size)
+        noise = rng.standard_normal((size, dimension), dtype=np.float32)
+        yield centers[labels] + 0.35 * noise
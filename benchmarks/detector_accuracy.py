@@ -0,0 +1,198 @@
+"""
+Accuracy and latency of the MTCNN precision variants against fp32.
+
+Detects every image of a local directory with fp32 and with each precision, matches
+the faces to the fp32 faces by box IoU, and reports recall, extra faces, mean IoU
+and landmark error normalised by the inter-ocular distance next to the per image
+latency of each precision.
+
+Usage:
+    python -m benchmarks.detector_accuracy --images /data/faces --output accuracy.json
+    python -m benchmarks.detector_accuracy --images /data/faces \\
+        --precisions bf16,int8_static --calibration /data/gallery/database/images
+"""
+
+# Standard Imports
+import time
+import logging
+import argparse
+from typing import List, Tuple
+
+# Third Party Imports
+import numpy as np
+
+# Internal Imports
+from models.detectors.mtcnn import FastMtcnn
+from configurations.config import app_config
+from structures.image import FaceSegment
+from models.detectors.fast_mtcnn.precision import calibration_images
+from benchmarks.harness import summarise, write_results, format_table
+from constants.constants import (
+    FP32_PRECISION,
+    BF16_PRECISION,
+    INT8_DYNAMIC_PRECISION,
+    INT8_STATIC_PRECISION,
+)
+
+PRECISIONS = (
+    FP32_PRECISION,
+    BF16_PRECISION,
+    INT8_DYNAMIC_PRECISION,
+    INT8_STATIC_PRECISION,
+)
+COLUMNS = (
+    "precision",
+    "images",
+    "faces",
+    "recall",
+    "extra",
+    "mean_iou",
+    "landmark_nme",
+    "p50_ms",
+    "p99_ms",
+    "throughput",
+)
+
+
+def _as_arrays(faces: List[FaceSegment]) -> Tuple[np.ndarray, np.ndarray]:
+    boxes = np.array(
+        [[face.x, face.y, face.x + face.w, face.y + face.h] for face in faces],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+    points = np.array([face.landmarks for face in faces], dtype=np.float64)
+    return boxes, points.reshape(-1, 5, 2)
+
+
+def box_iou(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """
+    IoU of every (x1, y1, x2, y2) box with every other box, shape (N, M).
+    """
+    x1 = np.maximum(boxes[:, None, 0], others[None, :, 0])
+    y1 = np.maximum(boxes[:, None, 1], others[None, :, 1])
+    x2 = np.minimum(boxes[:, None, 2], others[None, :, 2])
+    y2 = np.minimum(boxes[:, None, 3], others[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    other_area = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    return intersection / np.maximum(
+        area[:, None] + other_area[None] - intersection, 1e-9
+    )
+
+
+def match_faces(boxes: np.ndarray, others: np.ndarray, threshold=0.5) -> list:
+    """
+    Greedy one to one matching by decreasing IoU, (index, other index, iou) of
+    every pair above threshold.
+    """
+    if len(boxes) == 0 or len(others) == 0:
+        return []
+    iou = box_iou(boxes, others)
+    pairs, used, used_others = [], set(), set()
+    for flat in np.argsort(iou, axis=None)[::-1]:
+        idx, other = np.unravel_index(flat, iou.shape)
+        if iou[idx, other] < threshold:
+            break
+        if idx in used or other in used_others:
+            continue
+        pairs.append((int(idx), int(other), float(iou[idx, other])))
+        used.add(idx)
+        used_others.add(other)
+    return pairs
+
+
+def detect(detector: FastMtcnn, images: List[np.ndarray]):
+    detections, latencies = [], []
+    for image in images:
+        start_time = time.perf_counter()
+        faces = detector.predict([image])[0]
+        latencies.append(time.perf_counter() - start_time)
+        detections.append(_as_arrays(faces))
+    return detections, latencies
+
+
+def compare(reference, detections, iou_threshold) -> dict:
+    faces, matched, extra, ious, errors = 0, 0, 0, [], []
+    for (boxes, points), (other_boxes, other_points) in zip(reference, detections):
+        pairs = match_faces(boxes, other_boxes, iou_threshold)
+        faces += len(boxes)
+        matched += len(pairs)
+        extra += len(other_boxes) - len(pairs)
+        for idx, other, iou in pairs:
+            ious.append(iou)
+            # points 0 and 1 are the eyes
+            interocular = max(np.linalg.norm(points[idx, 0] - points[idx, 1]), 1e-9)
+            distance = np.linalg.norm(points[idx] - other_points[other], axis=1)
+            errors.append(float(distance.mean() / interocular))
+    return {
+        "faces": faces,
+        "recall": round(matched / faces, 4) if faces else None,
+        "extra": extra,
+        "mean_iou": round(float(np.mean(ious)), 4) if ious else None,
+        "landmark_nme": round(float(np.mean(errors)), 4) if errors else None,
+    }
+
+
+def run(args) -> list:
+    images = calibration_images(args.images, args.limit)
+    if len(images) == 0:
+        raise Exception(f"no images found under {args.images}")
+
+    arguments = (
+        dict(app_config.detector_model.arguments) if app_config.detector_model else {}
+    )
+    arguments.update(device="cpu", calibration_path=args.calibration)
+
+    results, reference = [], None
+    for precision in [FP32_PRECISION] + [
+        precision for precision in args.precisions if precision != FP32_PRECISION
+    ]:
+        logging.info(f"detecting {len(images)} images with {precision}")
+        detector = FastMtcnn(**{**arguments, "precision": precision})
+        detector.load(None)
+        if detector.precision != precision:
+            logging.error(f"{precision} is not available, skipping it")
+            continue
+        detector.predict(images[:1])
+        detections, latencies = detect(detector, images)
+        if reference is None:
+            reference = detections
+        results.append(
+            {
+                "precision": precision,
+                "images": len(images),
+                **compare(reference, detections, args.iou_threshold),
+                **summarise(latencies, len(images)),
+            }
+        )
+    return results
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", required=True, help="directory of test images")
+    parser.add_argument(
+        "--precisions",
+        type=lambda s: s.split(","),
+        default=PRECISIONS,
+    )
+    parser.add_argument(
+        "--calibration",
+        default=None,
+        help="int8_static calibration images, the gallery images by default",
+    )
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--iou-threshold", type=float, default=0.5)
+    parser.add_argument("--output", default="detector_accuracy_results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_arguments(argv)
+    results = run(args)
+    write_results(args.output, results, vars(args))
+    print(format_table(results, COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# Standard Imports
+import sys
+import json
+import time
+import platform
+import tracemalloc
+import subprocess
+from typing import Callable, List, Sequence
+
+# Third Party Imports
+import numpy as np
+
+# Internal Imports
+
+
+def measure(function: Callable, batches: Sequence, repeats=5, warmup=1) -> dict:
+    """
+    Calls function once per batch, repeats times, and summarises per call latency.
+    Args:
+        function (Callable): called with a single batch
+        batches (Sequence): batches, len(batch) is used as the number of items
+        repeats (int): number of passes over all batches
+        warmup (int): untimed calls made with the first batch
+    Returns:
+        summary (dict): p50/p99/mean latency in milliseconds and items per second
+    """
+    for _ in range(warmup):
+        function(batches[0])
+
+    latencies, items = [], 0
+    for _ in range(repeats):
+        for batch in batches:
+            start_time = time.perf_counter()
+            function(batch)
+            latencies.append(time.perf_counter() - start_time)
+            items += len(batch)
+    return summarise(latencies, items)
+
+
+def allocated_bytes(function: Callable, batch) -> dict:
+    """
+    Memory allocated while calling function(batch) once: torch CPU allocations from
+    the profiler's memory events (None without torch) and the tracemalloc peak of
+    Python and numpy allocations, both per item of the batch.
+    """
+    tracemalloc.start()
+    function(batch)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    torch_bytes = None
+    try:
+        from torch.profiler import profile, ProfilerActivity
+    except ImportError:
+        profile = None
+    if profile is not None:
+        with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+            function(batch)
+        torch_bytes = sum(
+            max(event.self_cpu_memory_usage, 0) for event in prof.events()
+        )
+
+    return {
+        "torch_bytes_per_item": (
+            None if torch_bytes is None else int(torch_bytes / len(batch))
+        ),
+        "traced_peak_bytes_per_item": int(peak / len(batch)),
+    }
+
+
+def summarise(latencies: List[float], items: int) -> dict:
+    latencies = np.array(latencies, dtype=np.float64) * 1000
+    return {
+        "calls": int(len(latencies)),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "throughput": round(float(items / (latencies.sum() / 1000)), 3),
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        )
+        commit = commit.decode("utf-8").strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def result_key(result: dict, key_fields: Sequence[str]) -> tuple:
+    return tuple(result.get(field) for field in key_fields)
+
+
+def write_results(path: str, results: List[dict], parameters: dict):
+    with open(path, "w") as file:
+        json.dump(
+            {
+                "environment": environment(),
+                "parameters": parameters,
+                "results": results,
+            },
+            file,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+def load_results(path: str) -> dict:
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def compare_results(
+    results: List[dict],
+    baseline: List[dict],
+    key_fields: Sequence[str],
+    metric="p50_ms",
+    tolerance=0.1,
+) -> List[dict]:
+    """
+    Compares metric of every result with the baseline result of the same key.
+    Returns a row per matched result with the relative change and whether it
+    regressed by more than tolerance (higher is worse for the metric).
+    """
+    baseline = {result_key(result, key_fields): result for result in baseline}
+    comparisons = []
+    for result in results:
+        key = result_key(result, key_fields)
+        if key not in baseline or not baseline[key].get(metric):
+            continue
+        change = (result[metric] - baseline[key][metric]) / baseline[key][metric]
+        comparisons.append(
+            {
+                **{field: result.get(field) for field in key_fields},
+                "baseline": baseline[key][metric],
+                "current": result[metric],
+                "change": round(change, 4),
+                "regressed": change > tolerance,
+            }
+        )
+    return comparisons
+
+
+def format_table(rows: List[dict], columns: Sequence[str] = None) -> str:
+    if len(rows) == 0:
+        return ""
+    if columns is None:
+        # union of the keys in row order, stages may report extra fields
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+    cells = [[str(column) for column in columns]] + [
+        [str(row.get(column, "")) for column in columns] for row in rows
+    ]
+    widths = [max(len(line[idx]) for line in cells) for idx in range(len(columns))]
+    lines = [
+        "  ".join(cell.ljust(width) for cell, width in zip(line, widths))
+        for line in cells
+    ]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
@@ -0,0 +1,212 @@
+"""
+Index scaling and recall benchmark for ImageMetadataStore.
+
+Builds the store faiss index for every gallery size and index configuration from
+clustered synthetic embeddings, and reports build time, memory, query latency per
+batch size and recall@k against exact Flat search.
+
+Usage:
+    python -m benchmarks.index_scaling --sizes 10000,100000,1000000 --output index.json
+    python -m benchmarks.index_scaling --sizes 10000000 \\
+        --indexes "HNSW32:efSearch=64;IVF{nlist},PQ64:nprobe=32"
+"""
+
+# Standard Imports
+import gc
+import time
+import logging
+import argparse
+
+# Third Party Imports
+import numpy as np
+
+# Internal Imports
+from utils.utils import process_rss_bytes
+from stores.image_store import ImageMetadataStore
+from constants.constants import COSINE_SIMILARITY
+from benchmarks.corpus import clustered_embedding_chunks
+from benchmarks.harness import measure, write_results, format_table
+
+DEFAULT_INDEXES = (
+    "Flat",
+    "HNSW32:efSearch=16",
+    "HNSW32:efSearch=64",
+    "HNSW32:efSearch=128",
+    "IVF{nlist},Flat:nprobe=1",
+    "IVF{nlist},Flat:nprobe=8",
+    "IVF{nlist},Flat:nprobe=32",
+    "IVF{nlist},SQ8:nprobe=8",
+    "IVF{nlist},SQ8:nprobe=32",
+    "IVF{nlist},PQ64:nprobe=8",
+    "IVF{nlist},PQ64:nprobe=32",
+)
+COLUMNS = (
+    "index_type",
+    "parameters",
+    "size",
+    "build_s",
+    "memory_mb",
+    "batch_size",
+    "p50_ms",
+    "p99_ms",
+    "throughput",
+    "recall",
+)
+
+
+def parse_index(index: str, size: int):
+    """
+    Parses "<faiss factory string>:<name>=<value>,..." into the factory string and
+    search parameters, {nlist} is replaced with 4 * sqrt(size).
+    """
+    factory, _, parameters = index.partition(":")
+    factory = factory.format(nlist=max(1, int(4 * np.sqrt(size))))
+    search_parameters = {}
+    for parameter in filter(None, parameters.split(",")):
+        name, value = parameter.split("=")
+        search_parameters[name] = int(value)
+    return factory, search_parameters
+
+
+def build_store(args, size, index_type, search_parameters) -> ImageMetadataStore:
+    store = ImageMetadataStore(
+        [],
+        vector_indexing=True,
+        indexing_kwargs={
+            "index_type": index_type,
+            "metric": args.metric,
+            "embedding_model": "FaceNet512",
+            "search_parameters": search_parameters,
+        },
+    )
+    # image metadata objects are skipped, they do not change index behaviour and
+    # would not fit in memory for the largest galleries
+    for idx, chunk in enumerate(
+        clustered_embedding_chunks(
+            size, 512, args.clusters(size), chunk_size=args.chunk_size, seed=args.seed
+        )
+    ):
+        if idx == 0:
+            # IVF and PQ index types are trained on the first chunk
+            store.train(chunk)
+        store.add_vectors(chunk)
+    return store
+
+
+def recall_at_k(indices: np.ndarray, ground_truth: np.ndarray, k: int) -> float:
+    hits = [
+        len(np.intersect1d(found[:k], truth[:k]))
+        for found, truth in zip(indices, ground_truth)
+    ]
+    return float(np.sum(hits) / (len(ground_truth) * k))
+
+
+def run(args) -> list:
+    results = []
+    for size in args.sizes:
+        queries = next(
+            clustered_embedding_chunks(
+                args.queries,
+                512,
+                args.clusters(size),
+                chunk_size=args.queries,
+                start=size,
+                seed=args.seed,
+            )
+        )
+
+        ground_truth = None
+        for index in args.indexes:
+            index_type, search_parameters = parse_index(index, size)
+            logging.info(
+                f"building {index_type} {search_parameters} with {size} vectors"
+            )
+
+            gc.collect()
+            rss_before = process_rss_bytes()
+            start_time = time.perf_counter()
+            store = build_store(args, size, index_type, search_parameters)
+            build_seconds = time.perf_counter() - start_time
+            rss_after = process_rss_bytes()
+
+            _, indices = store.search_arrays(queries, args.k)
+            if ground_truth is None:
+                # exact results come from the first (Flat) index
+                if index_type != "Flat":
+                    raise Exception("first index has to be Flat for recall@k")
+                ground_truth = indices
+
+            for batch_size in args.batch_sizes:
+                batches = [
+                    queries[idx : idx + batch_size]
+                    for idx in range(0, len(queries) - batch_size + 1, batch_size)
+                ]
+                summary = measure(
+                    lambda batch: store.search_arrays(batch, args.k),
+                    batches,
+                    repeats=args.repeats,
+                )
+                results.append(
+                    {
+                        "index_type": index_type,
+                        "parameters": ",".join(
+                            f"{k}={v}" for k, v in search_parameters.items()
+                        ),
+                        "size": size,
+                        "build_s": round(build_seconds, 3),
+                        "memory_mb": (
+                            round((rss_after - rss_before) / 2**20, 1)
+                            if rss_before is not None
+                            else None
+                        ),
+                        "batch_size": batch_size,
+                        "recall": round(recall_at_k(indices, ground_truth, args.k), 4),
+                        **summary,
+                    }
+                )
+            del store
+    return results
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(size) for size in s.split(",")],
+        default=[10000, 100000, 1000000],
+    )
+    parser.add_argument(
+        "--indexes",
+        type=lambda s: ["Flat"] + [i for i in s.split(";") if i and i != "Flat"],
+        default=list(DEFAULT_INDEXES),
+        help='semicolon separated "<factory string>:<param>=<value>" entries',
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=lambda s: [int(size) for size in s.split(",")],
+        default=[1, 16, 128],
+    )
+    parser.add_argument("--metric", default=COSINE_SIMILARITY)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1024)
+    parser.add_argument("--images-per-user", type=int, default=20)
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="index_scaling_results.json")
+    args = parser.parse_args(argv)
+    args.clusters = lambda size: max(1, size // args.images_per_user)
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_arguments(argv)
+    results = run(args)
+    parameters = {k: v for k, v in vars(args).items() if k != "clusters"}
+    write_results(args.output, results, parameters)
+    print(format_table(results, COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+HTTP load generator for the tornado app, sweeps concurrency levels with a
+weighted mix of endpoints and reports throughput, latency and error rate per
+endpoint.
+
+Usage:
+    python -m benchmarks.load --concurrency 1,4,16 --mix recognize=0.7,represent=0.2,face-detect=0.1
+    python -m benchmarks.load --server inprocess --output load.json --baseline baseline.json
+    python -m benchmarks.load --url http://localhost:8000 --duration 60
+"""
+
+# Standard Imports
+import os
+import sys
+import base64
+import json
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+import subprocess
+from typing import Dict, List
+
+# Third Party Imports
+import numpy as np
+import tornado.ioloop
+from tornado.httpclient import AsyncHTTPClient
+
+# Internal Imports
+from benchmarks.corpus import synthetic_faces, encode_images
+from benchmarks.harness import (
+    write_results,
+    load_results,
+    compare_results,
+    format_table,
+)
+
+KEY_FIELDS = ("concurrency", "endpoint")
+ENDPOINTS = ("recognize", "represent", "face-detect", "verify", "add")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_corpus(args) -> List[str]:
+    """
+    Base64 encoded images read from --corpus, or a synthetic corpus without it.
+    """
+    if args.corpus is None:
+        images, _ = synthetic_faces(args.corpus_size, args.resolution, seed=args.seed)
+        return encode_images(images)
+
+    encoded = []
+    for name in sorted(os.listdir(args.corpus)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(args.corpus, name), "rb") as file:
+                encoded.append(base64.b64encode(file.read()).decode("utf-8"))
+    if len(encoded) == 0:
+        raise Exception(f"no images found in corpus {args.corpus}")
+    return encoded
+
+
+def build_bodies(
+    corpus: List[str], endpoints, images_per_request=1, pool_size=32, seed=0
+) -> Dict[str, List[bytes]]:
+    """
+    Pre-encodes a pool of request bodies per endpoint so the client spends no
+    time on json encoding while the load is running.
+    """
+    rng = random.Random(seed)
+    bodies = {}
+    for endpoint in endpoints:
+        bodies[endpoint] = []
+        for _ in range(pool_size):
+            images = [rng.choice(corpus) for _ in range(images_per_request)]
+            if endpoint == "verify":
+                payloads = [
+                    {"image1": image, "image2": rng.choice(corpus)} for image in images
+                ]
+            elif endpoint == "add":
+                payloads = [
+                    {"image": image, "userId": f"load_user_{rng.randrange(1000)}"}
+                    for image in images
+                ]
+            else:
+                payloads = [{"image": image} for image in images]
+            bodies[endpoint].append(json.dumps({"payloads": payloads}).encode("utf-8"))
+    return bodies
+
+
+async def run_level(url, bodies, mix, concurrency, duration, timeout, seed=0):
+    """
+    Closed loop load, concurrency workers each keep exactly one request in flight
+    until duration seconds have passed.
+    Returns:
+        records (list): (endpoint, latency seconds, success) per request
+        wall_time (float): seconds from the first request to the last response
+    """
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    endpoints, weights = list(mix.keys()), list(mix.values())
+    records = []
+
+    async def worker(worker_id):
+        rng = random.Random(seed * 1000003 + worker_id)
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            body = rng.choice(bodies[endpoint])
+            start_time = time.perf_counter()
+            try:
+                response = await client.fetch(
+                    f"{url}/{endpoint}",
+                    method="POST",
+                    body=body,
+                    headers={"Content-Type": "application/json"},
+                    request_timeout=timeout,
+                    raise_error=False,
+                )
+                success = response.code == 200
+            except Exception:
+                success = False
+            records.append((endpoint, time.perf_counter() - start_time, success))
+
+    start_time = time.perf_counter()
+    deadline = start_time + duration
+    await asyncio.gather(*[worker(worker_id) for worker_id in range(concurrency)])
+    wall_time = time.perf_counter() - start_time
+    client.close()
+    return records, wall_time
+
+
+def summarise_level(records, wall_time, concurrency) -> List[dict]:
+    by_endpoint = {"all": records}
+    for record in records:
+        by_endpoint.setdefault(record[0], []).append(record)
+
+    results = []
+    for endpoint, endpoint_records in by_endpoint.items():
+        if len(endpoint_records) == 0:
+            continue
+        latencies = np.array([record[1] for record in endpoint_records]) * 1000
+        errors = sum(1 for record in endpoint_records if not record[2])
+        results.append(
+            {
+                "concurrency": concurrency,
+                "endpoint": endpoint,
+                "requests": len(endpoint_records),
+                "errors": errors,
+                "error_rate": round(errors / len(endpoint_records), 4),
+                "throughput": round(len(endpoint_records) / wall_time, 3),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p90_ms": round(float(np.percentile(latencies, 90)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+                "mean_ms": round(float(latencies.mean()), 3),
+            }
+        )
+    return results
+
+
+def _wait_for_port(port, timeout, process=None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise Exception(f"app exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("localhost", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise Exception(f"app did not listen on port {port} within {timeout} seconds")
+
+
+def start_subprocess_server(port, timeout):
+    environment = dict(os.environ, PORT=str(port))
+    process = subprocess.Popen([sys.executable, "app.py"], env=environment)
+    try:
+        _wait_for_port(port, timeout, process)
+    except Exception:
+        process.terminate()
+        raise
+    return process.terminate
+
+
+def start_inprocess_server(port, timeout):
+    """
+    Serves the app from a background thread with its own event loop, so handlers
+    blocking on inference do not stall the load generator loop.
+    """
+    import app
+
+    app.app_initializer()
+    loops = []
+
+    def serve():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        app.make_application().listen(port, address="localhost")
+        loops.append(tornado.ioloop.IOLoop.current())
+        loops[0].start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    _wait_for_port(port, timeout)
+    return lambda: loops[0].add_callback(loops[0].stop)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        endpoint, _, weight = item.partition("=")
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {endpoint}")
+        mix[endpoint] = float(weight or 1)
+    return mix
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--server",
+        choices=["subprocess", "inprocess"],
+        default="subprocess",
+        help="how the app is started, ignored when --url is given",
+    )
+    parser.add_argument("--url", default=None, help="target an already running app")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument(
+        "--concurrency",
+        type=lambda s: [int(level) for level in s.split(",")],
+        default=[1, 2, 4, 8, 16],
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default={"recognize": 0.7, "represent": 0.2, "face-detect": 0.1},
+        help="comma separated endpoint=weight, add mutates the gallery",
+    )
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=5, help="untimed seconds")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--corpus", default=None, help="directory of jpg/png images")
+    parser.add_argument("--corpus-size", type=int, default=16)
+    parser.add_argument(
+        "--resolution",
+        type=lambda s: tuple(int(v) for v in s.split("x")),
+        default=(640, 480),
+        help="WIDTHxHEIGHT of the synthetic corpus",
+    )
+    parser.add_argument("--images-per-request", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+async def sweep(args, url, bodies) -> List[dict]:
+    if args.warmup > 0:
+        await run_level(
+            url, bodies, args.mix, 1, args.warmup, args.timeout, seed=args.seed
+        )
+    results = []
+    for concurrency in args.concurrency:
+        logging.info(f"running {args.duration}s at concurrency {concurrency}")
+        records, wall_time = await run_level(
+            url,
+            bodies,
+            args.mix,
+            concurrency,
+            args.duration,
+            args.timeout,
+            seed=args.seed,
+        )
+        results.extend(summarise_level(records, wall_time, concurrency))
+    return results
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_arguments(argv)
+
+    bodies = build_bodies(
+        load_corpus(args),
+        args.mix.keys(),
+        images_per_request=args.images_per_request,
+        seed=args.seed,
+    )
+
+    stop_server = None
+    url = args.url
+    if url is None:
+        url = f"http://localhost:{args.port}"
+        if args.server == "inprocess":
+            stop_server = start_inprocess_server(args.port, args.startup_timeout)
+        else:
+            stop_server = start_subprocess_server(args.port, args.startup_timeout)
+
+    try:
+        results = asyncio.run(sweep(args, url, bodies))
+    finally:
+        if stop_server is not None:
+            stop_server()
+
+    write_results(args.output, results, vars(args))
+    print(format_table(results))
+
+    if args.baseline:
+        comparisons = compare_results(
+            [result for result in results if result["endpoint"] == "all"],
+            load_results(args.baseline)["results"],
+            KEY_FIELDS,
+            metric="p99_ms",
+            tolerance=args.tolerance,
+        )
+        print(format_table(comparisons))
+        if args.fail_on_regression and any(row["regressed"] for row in comparisons):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
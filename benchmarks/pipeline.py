@@ -0,0 +1,228 @@
+"""
+End to end benchmark of the decode, detection, embedding and search stages.
+
+Usage:
+    python -m benchmarks.pipeline --output results.json
+    python -m benchmarks.pipeline --output results.json --baseline baseline.json
+"""
+
+# Standard Imports
+import sys
+import logging
+import argparse
+
+# Third Party Imports
+import numpy as np
+
+# Internal Imports
+from components.detection import detection
+from components.embeddings import embeddings
+from components.result_cache import result_cache
+from models.model_holder import ModelHolder
+from configurations.config import app_config
+from structures.image import ImageMetadata, DetectedFace, FaceSegment
+from stores.image_store import ImageMetadataStore
+from models.embeddings.facenet import FaceNet512
+from utils.image_utils import load_image_using_pil, resize_image
+from constants.constants import EMBEDDING_MODEL_DIMENSION
+from benchmarks.corpus import (
+    synthetic_faces,
+    crop_faces,
+    encode_images,
+    synthetic_embeddings,
+)
+from benchmarks.harness import (
+    measure,
+    allocated_bytes,
+    write_results,
+    load_results,
+    compare_results,
+    format_table,
+)
+
+KEY_FIELDS = ("stage", "resolution", "batch_size")
+STAGES = ("decode", "detection", "preprocess", "embedding", "search")
+# stages also reporting the memory allocated per image
+ALLOCATION_STAGES = ("detection",)
+
+
+def _batches(items, batch_size):
+    return [
+        items[idx : idx + batch_size]
+        for idx in range(0, len(items) - batch_size + 1, batch_size)
+    ]
+
+
+def _model_config():
+    if app_config.detector_model and app_config.embedding_model:
+        return (
+            app_config.detector_model.name,
+            dict(app_config.detector_model.arguments),
+            app_config.embedding_model.name,
+            dict(app_config.embedding_model.arguments),
+        )
+    return "FastMtcnn", {"align": True}, "FaceNet512", {}
+
+
+def _legacy_preprocess(batch):
+    # float64 crop, resize, pad and img_to_array copies per face, as before the
+    # uint8 batch buffer
+    return [
+        resize_image(img=crop[:, :, ::-1] / 255, target_size=(160, 160))
+        for crop in batch
+    ]
+
+
+def run(args) -> list:
+    detector_name, detector_arguments, embedding_name, embedding_arguments = (
+        _model_config()
+    )
+    # every batch is repeated, measure the models instead of the result cache
+    result_cache.max_bytes = 0
+    if "detection" in args.stages:
+        ModelHolder.get_or_load_model(detector_name, **detector_arguments)
+    if "embedding" in args.stages:
+        ModelHolder.get_or_load_model(embedding_name, **embedding_arguments)
+
+    count = max(args.batch_sizes)
+    results = []
+    for resolution in args.resolutions:
+        images, boxes = synthetic_faces(count, resolution, seed=args.seed)
+        label = f"{resolution[0]}x{resolution[1]}"
+
+        stage_inputs = {}
+        if "decode" in args.stages:
+            stage_inputs["decode"] = (
+                encode_images(images),
+                lambda batch: [load_image_using_pil(image) for image in batch],
+            )
+        if "detection" in args.stages:
+            stage_inputs["detection"] = (
+                images,
+                lambda batch: detection(
+                    images=batch, model_name=detector_name, **detector_arguments
+                ),
+            )
+        if "preprocess" in args.stages:
+            # embedding model input preparation only, no weights needed
+            facenet = FaceNet512()
+            crops = crop_faces(images, boxes)
+            stage_inputs["preprocess"] = (crops, facenet.preprocess)
+            stage_inputs["preprocess_legacy"] = (crops, _legacy_preprocess)
+        if "embedding" in args.stages:
+            stage_inputs["embedding"] = (
+                crop_faces(images, boxes),
+                lambda batch: embeddings(images=batch, model_name=embedding_name),
+            )
+
+        for stage, (inputs, function) in stage_inputs.items():
+            for batch_size in args.batch_sizes:
+                logging.info(f"benchmarking {stage} at {label}, batch {batch_size}")
+                batches = _batches(inputs, batch_size)
+                summary = measure(function, batches, repeats=args.repeats)
+                if stage in ALLOCATION_STAGES:
+                    summary.update(allocated_bytes(function, batches[0]))
+                results.append(
+                    {
+                        "stage": stage,
+                        "resolution": label,
+                        "batch_size": batch_size,
+                        **summary,
+                    }
+                )
+
+    if "search" in args.stages:
+        results.extend(benchmark_search(args, embedding_name))
+    return results
+
+
+def benchmark_search(args, embedding_name) -> list:
+    dimension = EMBEDDING_MODEL_DIMENSION[embedding_name]
+    gallery, labels = synthetic_embeddings(
+        args.gallery_size, dimension, clusters=max(1, args.gallery_size // 20)
+    )
+    image_metadata = [
+        ImageMetadata(
+            image_path=f"images/user_{label}/image_{idx}.jpeg",
+            user_id=f"user_{label}",
+            hash_key=str(idx),
+            detected_faces=[
+                DetectedFace(
+                    model_name=None,
+                    facial_segments=FaceSegment(x=0, y=0, w=0, h=0),
+                    embeddings={embedding_name: embedding},
+                )
+            ],
+        )
+        for idx, (embedding, label) in enumerate(zip(gallery, labels))
+    ]
+    store = ImageMetadataStore(
+        image_metadata,
+        vector_indexing=True,
+        indexing_kwargs={"index_type": "Flat", "embedding_model": embedding_name},
+    )
+    queries, _ = synthetic_embeddings(
+        max(args.batch_sizes) * 4, dimension, seed=args.seed + 1
+    )
+
+    results = []
+    for batch_size in args.batch_sizes:
+        summary = measure(
+            lambda batch: store.search_arrays(batch, args.nearest_neighbours),
+            _batches(queries, batch_size),
+            repeats=args.repeats,
+        )
+        results.append(
+            {"stage": "search", "resolution": None, "batch_size": batch_size, **summary}
+        )
+    return results
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stages", type=lambda s: s.split(","), default=STAGES)
+    parser.add_argument(
+        "--batch-sizes",
+        type=lambda s: [int(size) for size in s.split(",")],
+        default=[1, 4, 16],
+    )
+    parser.add_argument(
+        "--resolutions",
+        type=lambda s: [tuple(int(v) for v in r.split("x")) for r in s.split(",")],
+        default=[(640, 480), (1280, 720), (1920, 1080)],
+        help="comma separated WIDTHxHEIGHT values",
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gallery-size", type=int, default=10000)
+    parser.add_argument("--nearest-neighbours", type=int, default=1)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_arguments(argv)
+    np.random.seed(args.seed)
+
+    results = run(args)
+    write_results(args.output, results, vars(args))
+    print(format_table(results))
+
+    if args.baseline:
+        comparisons = compare_results(
+            results,
+            load_results(args.baseline)["results"],
+            KEY_FIELDS,
+            tolerance=args.tolerance,
+        )
+        print(format_table(comparisons))
+        if args.fail_on_regression and any(row["regressed"] for row in comparisons):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
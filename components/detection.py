@@ -6,15 +6,18 @@ import numpy as np
 
 # Internal Imports
 from utils.utils import timeit
+from utils.tracing import span
 from models.model_holder import ModelHolder
 from configurations.config import app_config
-from utils.image_utils import load_image_using_pil
+from utils.image_utils import load_images, iter_decoded
+from components.result_cache import result_cache, image_key
 from models.detectors import AbstractDetectionModel
 from structures.image import FaceSegment, DetectedFace
+from constants.constants import EYES_ALIGNMENT, FIVE_POINT_ALIGNMENT, FACE_CHIP_SIZE
 from utils.image_utils import (
     expand_image_with_percentage,
-    align_face,
-    rotate_facial_area,
+    align_facial_area,
+    align_five_points,
 )
 
 
@@ -24,8 +27,17 @@ def detection(
     model_name,
     align=False,
     expand_percentage=0,
+    cache_keys=None,
+    alignment_mode=EYES_ALIGNMENT,
+    draft_max_side=None,
     **kwargs,
 ) -> List[List[DetectedFace]]:
+    """
+    Images are decoded concurrently and each is detected as soon as it is decoded.
+    With draft_max_side, JPEG inputs are decoded in draft mode and detected at
+    reduced resolution, faces are reported in full resolution coordinates and
+    cropped from a full decode of the images having faces.
+    """
 
     try:
         detection_model: AbstractDetectionModel = ModelHolder.get_or_load_model(
@@ -37,62 +49,120 @@ def detection(
     if not isinstance(images, list):
         images = [images]
 
-    images = [load_image_using_pil(image) for image in images]
+    # keys hash the encoded images, computed before any decoding
+    sources = images
+    # keys given by represent were already looked up and counted there
+    record = cache_keys is None
+    if cache_keys is None:
+        cache_keys = [
+            (
+                image_key(
+                    source,
+                    model_name,
+                    align,
+                    expand_percentage,
+                    alignment_mode=alignment_mode,
+                    draft_max_side=draft_max_side,
+                    **kwargs,
+                )
+                if result_cache.enabled
+                else None
+            )
+            for source in sources
+        ]
 
-    try:
-        model_output: List[List[FaceSegment]] = detection_model.predict(images)
-    except Exception as e:
-        raise Exception(f"Error in face detection model: {str(e)}")
+    # cached entries only hold the segments, crops are cut again from the image
+    outputs = [result_cache.get(key, record=record) for key in cache_keys]
+    missed = [idx for idx, faces in enumerate(outputs) if faces is None]
 
-    outputs = []
-    for idx, detected_faces in enumerate(model_output):
-        if len(detected_faces) == 0:
-            outputs.append([])
+    # images are detected as they finish decoding, while the others still decode
+    images, scales = [None] * len(sources), [1.0] * len(sources)
+    for idx, image, scale in iter_decoded(sources, draft_max_side):
+        images[idx], scales[idx] = image, scale
+        if image is None:
+            # images failing to decode have no faces instead of failing the batch
+            outputs[idx] = []
+            continue
+        if outputs[idx] is not None:
             continue
+        try:
+            model_output: List[List[FaceSegment]] = detection_model.predict([image])
+        except Exception as e:
+            raise Exception(f"Error in face detection model: {str(e)}")
+
         faces = []
-        image = images[idx]
-        for face in detected_faces:
+        for face in model_output[0]:
+            if not face.confidence or face.confidence <= kwargs.get(
+                "confidence_threshold", 0.85
+            ):
+                continue
             x, y, w, h = expand_image_with_percentage(
                 face.x, face.y, face.w, face.h, image, expand_percentage
             )
-
-            detected_face = image[int(y) : int(y + h), int(x) : int(x + w)]
-            if align:
-                aligned_img, angle = align_face(
-                    img=image, left_eye=face.left_eye, right_eye=face.right_eye
-                )
-                rotated_x1, rotated_y1, rotated_x2, rotated_y2 = rotate_facial_area(
-                    facial_area=(x, y, x + w, y + h),
-                    angle=angle,
-                    size=(image.shape[0], image.shape[1]),
-                )
-                detected_face = aligned_img[
-                    int(rotated_y1) : int(rotated_y2),
-                    int(rotated_x1) : int(rotated_x2),
-                ]
-            detected_face = detected_face / 255
-            if (
-                face.confidence
-                and face.confidence > kwargs.get("confidence_threshold", 0.85)
-                and detected_face.shape[0] != 0
-                and detected_face.shape[1] != 0
-            ):
-                faces.append(
-                    DetectedFace(
-                        model_name=model_name,
-                        image=detected_face,
-                        facial_segments=FaceSegment(
-                            x=x,
-                            y=y,
-                            w=w,
-                            h=h,
-                            left_eye=face.left_eye,
-                            right_eye=face.right_eye,
-                            confidence=face.confidence,
-                        ),
-                        alignment=align,
-                        expand_percentage=expand_percentage,
-                    )
+            segments = FaceSegment(
+                x=x,
+                y=y,
+                w=w,
+                h=h,
+                left_eye=face.left_eye,
+                right_eye=face.right_eye,
+                confidence=face.confidence,
+                landmarks=face.landmarks,
+            )
+            faces.append(
+                DetectedFace(
+                    model_name=model_name,
+                    facial_segments=segments.scale(scale),
+                    alignment=align,
+                    expand_percentage=expand_percentage,
+                    alignment_mode=alignment_mode,
                 )
-        outputs.append(faces)
+            )
+        outputs[idx] = faces
+    missed = [idx for idx in missed if images[idx] is not None]
+
+    # faces found in draft decoded images are cropped at full resolution
+    reduced = [idx for idx, faces in enumerate(outputs) if faces and scales[idx] != 1]
+    full_images = dict(zip(reduced, load_images([sources[idx] for idx in reduced])))
+    for idx, faces in enumerate(outputs):
+        image, scale = full_images.get(idx), 1
+        if image is None:
+            image, scale = images[idx], scales[idx]
+        for face in faces:
+            face.image = crop_face(
+                image, face.facial_segments.scale(1 / scale), align, alignment_mode
+            )
+        outputs[idx] = [
+            face for face in faces if face.image.shape[0] and face.image.shape[1]
+        ]
+    for idx in missed:
+        result_cache.put(cache_keys[idx], outputs[idx])
     return outputs
+
+
+def crop_face(
+    image, segments: FaceSegment, align=False, alignment_mode=EYES_ALIGNMENT
+) -> np.ndarray:
+    """
+    Cuts the facial area of segments, kept in uint8 until the embedding model
+    batches it. With align, the area is rotated around the eyes, or with
+    five_point alignment warped from the five landmarks to a model-ready float32
+    FACE_CHIP_SIZE chip in [0, 1].
+    """
+    if align and alignment_mode == FIVE_POINT_ALIGNMENT and segments.landmarks:
+        with span("alignment"):
+            chip = align_five_points(image, segments.landmarks, FACE_CHIP_SIZE)
+        if chip is not None:
+            return chip
+
+    x, y, w, h = segments.x, segments.y, segments.w, segments.h
+    detected_face = image[int(y) : int(y + h), int(x) : int(x + w)]
+    if align:
+        with span("alignment"):
+            detected_face = align_facial_area(
+                img=image,
+                facial_area=(x, y, x + w, y + h),
+                left_eye=segments.left_eye,
+                right_eye=segments.right_eye,
+            )
+    return detected_face
@@ -7,12 +7,16 @@ from typing import Union, List
 import numpy as np
 
 # Internal Imports
-from utils.utils import timeit
-from components.detection import detection
+from utils.utils import timeit, normalize_vectors
+from components.detection import detection, crop_face
+from stores.embedding_cache import embedding_cache
+from components.result_cache import result_cache, image_key
 from models.model_holder import ModelHolder
-from utils.image_utils import load_image_using_pil
+from configurations.config import app_config
+from constants.constants import EYES_ALIGNMENT
+from utils.image_utils import load_image_using_pil, load_images
 from models.embeddings import AbstractEmbeddingModel
-from structures.image import FaceSegment, DetectedFace
+from structures.image import FaceSegment, DetectedFace, ImageMetadata
 
 
 @timeit
@@ -57,19 +61,53 @@ def represent(
         return []
 
     list_of_images = copy.deepcopy(images)
-    images = [load_image_using_pil(image) for image in images]
+    # keys hash the encoded images, so cached images are never decoded
+    cache_keys = [
+        (
+            image_key(image, detector_name, align, expand_percentage, **kwargs)
+            if result_cache.enabled or embedding_cache.enabled
+            else None
+        )
+        for image in images
+    ]
+
+    outputs = [result_cache.get(key, embedding_name) for key in cache_keys]
+    missed = [idx for idx, faces in enumerate(outputs) if faces is None]
+    if len(missed) == 0:
+        return outputs
+
+    model_version = ModelHolder.get_or_load_model(embedding_name).version
+    stored = embedding_cache.get_many(
+        [cache_keys[idx] for idx in missed], embedding_name, model_version
+    )
+    for idx in missed:
+        if cache_keys[idx] in stored:
+            outputs[idx] = stored[cache_keys[idx]]
+            result_cache.put(cache_keys[idx], outputs[idx])
+    missed = [idx for idx in missed if outputs[idx] is None]
+    if len(missed) == 0:
+        return outputs
 
     detected_outputs = []
     if detector_name:
+        # detection decodes the missed images and detects each as soon as it is
+        # decoded, images failing to decode have no faces
         detected_outputs = detection(
-            images,
+            [list_of_images[idx] for idx in missed],
             detector_name,
             align=align,
             expand_percentage=expand_percentage,
+            cache_keys=[cache_keys[idx] for idx in missed],
             **kwargs,
         )
     else:
-        for idx, image in enumerate(images):
+        # without a detector the whole image is the face, it is never draft decoded
+        images = dict(zip(missed, load_images([images[idx] for idx in missed])))
+        for idx in missed:
+            image = images[idx]
+            if image is None:
+                detected_outputs.append([])
+                continue
             detected_outputs.append(
                 [
                     DetectedFace(
@@ -85,7 +123,7 @@ def represent(
             )
 
     embedding_batch = []
-    for idx, detected_output in enumerate(detected_outputs):
+    for idx, detected_output in zip(missed, detected_outputs):
         if len(detected_output) == 0:
             logging.error("Image path: {}".format(list_of_images[idx]))
         if len(detected_output) > 1:
@@ -95,10 +133,103 @@ def represent(
             embedding_batch.append(face.image)
 
     embeds = embeddings(images=embedding_batch, model_name=embedding_name)
+    normalized = ModelHolder.get_or_load_model(embedding_name).normalize
 
     pointer = 0
-    for detected_output in detected_outputs:
+    for idx, detected_output in zip(missed, detected_outputs):
         for face in detected_output:
-            face.add_embedding(model_name=embedding_name, embedding=embeds[pointer])
+            face.add_embedding(
+                model_name=embedding_name,
+                embedding=embeds[pointer],
+                normalized=normalized,
+            )
             pointer += 1
-    return detected_outputs
+        result_cache.put(cache_keys[idx], detected_output)
+        outputs[idx] = detected_output
+    embedding_cache.put_many(
+        {cache_keys[idx]: outputs[idx] for idx in missed}, embedding_name, model_version
+    )
+    return outputs
+
+
+@timeit
+def reembed(
+    image_metadata: List[ImageMetadata], embedding_name, batch_size=32
+) -> List[ImageMetadata]:
+    """
+    Adds embedding_name embeddings to stored faces missing them, cropping and
+    aligning from the persisted FaceSegment boxes and eyes, so switching the
+    embedding model runs only the new model instead of detection as well. Stored
+    embeddings are brought to the normalize setting of the model first, and faces
+    aligned in another alignment mode than configured are embedded again.
+    Args:
+        image_metadata (List[ImageMetadata]): metadata with detected faces
+        embedding_name (str): embedding model to add
+        batch_size (int): images decoded and embedded at once
+    Returns:
+        image_metadata (List[ImageMetadata]): the same metadata, updated in place
+    """
+    normalized = ModelHolder.get_or_load_model(embedding_name).normalize
+    alignment_mode = (
+        app_config.detector_model.arguments.get("alignment_mode", EYES_ALIGNMENT)
+        if app_config.detector_model
+        else EYES_ALIGNMENT
+    )
+    for metadata in image_metadata:
+        for face in metadata.detected_faces:
+            if face.alignment and face.alignment_mode != alignment_mode:
+                # embeddings of faces aligned in another mode never match queries
+                face.embeddings.clear()
+                face.normalized.clear()
+                face.alignment_mode = alignment_mode
+            embedding = face.get_embedding(embedding_name)
+            if embedding is None or face.is_normalized(embedding_name) == normalized:
+                continue
+            if normalized:
+                # raw embeddings stored before normalize was enabled
+                face.add_embedding(
+                    embedding_name, normalize_vectors(np.asarray(embedding)), True
+                )
+            else:
+                # raw embeddings cannot be recovered from normalized ones
+                face.embeddings.pop(embedding_name)
+                face.normalized.pop(embedding_name, None)
+
+    stale = [
+        metadata
+        for metadata in image_metadata
+        if any(
+            face.get_embedding(embedding_name) is None
+            for face in metadata.detected_faces
+        )
+    ]
+    if len(stale) == 0:
+        return image_metadata
+
+    logging.info(f"Adding {embedding_name} embeddings to {len(stale)} stored images")
+    for start in range(0, len(stale), batch_size):
+        faces, crops = [], []
+        batch = stale[start : start + batch_size]
+        images = load_images([metadata.image_path for metadata in batch])
+        for metadata, image in zip(batch, images):
+            if image is None:
+                continue
+            for face in metadata.detected_faces:
+                if face.get_embedding(embedding_name) is not None:
+                    continue
+                crop = crop_face(
+                    image, face.facial_segments, face.alignment, alignment_mode
+                )
+                if crop.shape[0] == 0 or crop.shape[1] == 0:
+                    continue
+                faces.append(face)
+                crops.append(crop)
+
+        if len(crops) == 0:
+            continue
+        embeds = embeddings(images=crops, model_name=embedding_name)
+        for face, embedding in zip(faces, embeds):
+            face.add_embedding(
+                model_name=embedding_name, embedding=embedding, normalized=normalized
+            )
+    return image_metadata
@@ -45,9 +45,11 @@ def add_images_to_image_store(
         expand_percentage=expand_percentage,
         **kwargs,
     )
-    try:
-        image_metadata = []
-        for idx, detected_face in enumerate(representations):
+    # images are exported one by one, an image which cannot be decoded or saved
+    # fails on its own instead of failing the whole batch
+    image_metadata = []
+    for idx, detected_face in enumerate(representations):
+        try:
             image_base_path = os.path.join(
                 store_path, "database", "images", user_ids[idx]
             )
@@ -66,9 +68,16 @@ def add_images_to_image_store(
                     detected_faces=detected_face,
                 )
             )
+        except Exception as e:
+            logging.error(f"Error in saving image for user {user_ids[idx]}: {str(e)}")
+            image_metadata.append(f"Error in saving the image: {str(e)}")
 
-        results = []
+    results = []
+    try:
         for metadata in image_metadata:
+            if isinstance(metadata, str):
+                results.append({"success": False, "errors": metadata})
+                continue
             is_add, errors = image_store.add(metadata)
 
             # if image already exists delete it from the path
@@ -0,0 +1,195 @@
+# Standard Imports
+import time
+import hashlib
+import logging
+import dataclasses
+from threading import Lock
+from collections import OrderedDict
+from typing import List, Union
+
+# Third Part Imports
+import numpy as np
+
+# Internal Imports
+from configurations.config import app_config
+from constants.constants import EYES_ALIGNMENT
+from structures.image import DetectedFace
+from utils.image_utils import content_hash
+from utils.metrics import CACHE_REQUESTS, CACHE_BYTES, CACHE_ENTRIES
+
+# rough per face cost of the DetectedFace, FaceSegment and dict objects
+FACE_OVERHEAD_BYTES = 512
+# detector arguments changing the scale pyramid or the nets, hence the faces
+DETECTOR_ARGUMENTS = (
+    "min_face_size",
+    "max_face_size",
+    "min_face_fraction",
+    "factor",
+    "precision",
+    "draft_max_side",
+)
+# detector arguments of tiled detection, which changes the faces found as well
+TILING_ARGUMENTS = ("tile_size", "tile_overlap", "max_detection_bytes")
+
+
+def _copy_face(face: DetectedFace) -> DetectedFace:
+    # crops are never cached, embedding dicts are copied so add_embedding on a
+    # returned face does not leak into the cache
+    return dataclasses.replace(
+        face,
+        image=None,
+        embeddings=dict(face.embeddings),
+        normalized=dict(face.normalized),
+    )
+
+
+def _entry_bytes(faces: List[DetectedFace]) -> int:
+    size = 0
+    for face in faces:
+        size += FACE_OVERHEAD_BYTES
+        for embedding in face.embeddings.values():
+            size += np.asarray(embedding).nbytes
+    return size
+
+
+def image_key(
+    image: Union[str, np.ndarray],
+    detector_name,
+    align=False,
+    expand_percentage=0,
+    **kwargs,
+) -> Union[str, None]:
+    """
+    SHA-256 of the image content hash (encoded bytes of paths and base64 strings,
+    pixels of arrays) plus every argument affecting detection output. Computed
+    before decoding, None when the image cannot be read.
+    """
+    try:
+        content = content_hash(image)
+    except Exception as e:
+        logging.error(f"Error in hashing image: {str(e)}")
+        return None
+
+    digest = hashlib.sha256()
+    digest.update(content.encode("utf-8"))
+    digest.update(
+        "|".join(
+            [
+                str(detector_name),
+                str(align),
+                str(expand_percentage),
+                str(kwargs.get("confidence_threshold", None)),
+                str(kwargs.get("alignment_mode", EYES_ALIGNMENT)),
+                # only when configured, keeping keys of older cache entries valid
+                *(
+                    f"{name}={kwargs[name]}"
+                    for name in DETECTOR_ARGUMENTS
+                    if kwargs.get(name) is not None
+                ),
+                # tile_overlap has a default, it only matters once tiling is enabled
+                *(
+                    f"{name}={kwargs[name]}"
+                    for name in TILING_ARGUMENTS
+                    if kwargs.get(name) is not None
+                    and (kwargs.get("tile_size") or kwargs.get("max_detection_bytes"))
+                ),
+            ]
+        ).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of detection and embedding results per image content, bounded by
+    an estimated size in bytes and a TTL. Entries hold the DetectedFace segments
+    and embeddings (never the face crops) of one image for one detector config.
+    """
+
+    def __init__(self, name: str, max_bytes=0, ttl_seconds=300):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits, self._misses = 0, 0
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(
+        self, key, embedding_name=None, record=True
+    ) -> Union[List[DetectedFace], None]:
+        """
+        Cached faces of key, None on a miss. With embedding_name, entries whose
+        faces lack that embedding are misses as well. With record False the lookup
+        is left out of the hit rate, for images whose lookup the caller counted.
+        """
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            if entry is not None and embedding_name is not None:
+                if any(face.get_embedding(embedding_name) is None for face in entry[1]):
+                    entry = None
+            if entry is None:
+                if record:
+                    self._misses += 1
+                    CACHE_REQUESTS.inc(cache=self.name, result="miss")
+                return None
+            self._entries.move_to_end(key)
+            if record:
+                self._hits += 1
+        if record:
+            CACHE_REQUESTS.inc(cache=self.name, result="hit")
+        return [_copy_face(face) for face in entry[1]]
+
+    def put(self, key, faces: List[DetectedFace]):
+        if key is None:
+            return
+        faces = [_copy_face(face) for face in faces]
+        size = _entry_bytes(faces)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time(), faces, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+            CACHE_BYTES.set(self._bytes, cache=self.name)
+            CACHE_ENTRIES.set(len(self._entries), cache=self.name)
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / requests, 4) if requests else 0.0,
+            }
+
+
+result_cache = ResultCache(
+    "results",
+    max_bytes=app_config.result_cache.max_bytes,
+    ttl_seconds=app_config.result_cache.ttl_seconds,
+)
@@ -7,9 +7,16 @@ import numpy as np
 
 # Internal Imports
 from utils.utils import timeit
+from utils.tracing import span
 from components.embeddings import represent
 from stores.store_holder import StoreHolder
-from constants.constants import VERIFICATION_THRESHOLDS, COSINE_SIMILARITY, EUCLIDEAN_L2
+from constants.constants import (
+    VERIFICATION_THRESHOLDS,
+    COSINE_SIMILARITY,
+    EUCLIDEAN_L2,
+    NEAREST_SEARCH,
+    RANGE_SEARCH,
+)
 from stores.image_store import ImageMetadataStore, FaissSearchResult
 
 
@@ -62,7 +69,13 @@ def verification(
             for face2 in faces2:
                 embedding1 = face1.get_embedding(embedding_name)
                 embedding2 = face2.get_embedding(embedding_name)
-                distance = get_distance(embedding1, embedding2, metric)
+                distance = get_distance(
+                    embedding1,
+                    embedding2,
+                    metric,
+                    normalized=face1.is_normalized(embedding_name)
+                    and face2.is_normalized(embedding_name),
+                )
                 if distance and (
                     optimal_distance is None
                     or verify_distance(
@@ -105,6 +118,7 @@ def recognize(
     detector_name=None,
     align=False,
     expand_percentage=0,
+    search_mode=NEAREST_SEARCH,
     **kwargs,
 ):
     try:
@@ -129,61 +143,118 @@ def recognize(
         for face in detected_faces:
             queries.append(face.get_embedding(embedding_name))
 
-    search_results: List[List[FaissSearchResult]] = image_store.search(queries, 1)
-    outputs, pointer = [], 0
-    for idx in range(len(images)):
-        detected_faces = representations[idx]
-        search_result = search_results[pointer : pointer + len(detected_faces)]
-        closest_result = None
-        for idy, face in enumerate(detected_faces):
-            req_result = search_result[idy]
-            for _search in req_result:
-                if _search and (
-                    closest_result is None
-                    or verify_distance(
-                        _search.distance, closest_result.distance, _search.metric_type
+    face_counts = [len(detected_faces) for detected_faces in representations]
+    normalized = all(
+        face.is_normalized(embedding_name)
+        for detected_faces in representations
+        for face in detected_faces
+    )
+    with span("faiss_search"):
+        if search_mode == RANGE_SEARCH or image_store.identity_indexing:
+            if search_mode == RANGE_SEARCH:
+                # every gallery face within the threshold, instead of a single neighbour
+                search_results: List[List[FaissSearchResult]] = (
+                    image_store.range_search(
+                        queries,
+                        VERIFICATION_THRESHOLDS[embedding_name][image_store.metric],
+                        normalized=normalized,
+                        with_embedding=False,
                     )
-                ):
-                    closest_result = _search
+                )
+            else:
+                search_results: List[List[FaissSearchResult]] = (
+                    image_store.search_identities(
+                        queries, 1, normalized=normalized, with_embedding=False
+                    )
+                )
+            closest_results, matches = _closest_from_search_results(
+                search_results, face_counts, image_store
+            )
+        else:
+            distances, indices = image_store.search_arrays(
+                queries, 1, normalized=normalized
+            )
+            closest_results = _closest_from_search_arrays(
+                distances[:, 0], indices[:, 0], face_counts, image_store
+            )
+            matches = [[] for _ in face_counts]
 
+    outputs = []
+    for idx, closest_result in enumerate(closest_results):
         if closest_result is not None:
+            distance, user_id = closest_result
+            threshold = VERIFICATION_THRESHOLDS[embedding_name][image_store.metric]
             output = {
-                "verified": verify_distance(
-                    closest_result.distance,
-                    VERIFICATION_THRESHOLDS[embedding_name][closest_result.metric_type],
-                    closest_result.metric_type,
-                ),
-                "distance": round(float(closest_result.distance), 2),
-                "metric": closest_result.metric_type,
-                "threshold": VERIFICATION_THRESHOLDS[embedding_name][
-                    closest_result.metric_type
-                ],
+                "verified": verify_distance(distance, threshold, image_store.metric),
+                "distance": round(float(distance), 2),
+                "metric": image_store.metric,
+                "threshold": threshold,
                 "embedding_model": embedding_name,
                 "detector_model": detector_name,
             }
-            if output["verified"]:
-                output["userId"] = image_store.get(
-                    closest_result.key.image_hash_key
-                ).user_id
-            else:
-                output["userId"] = None
-            outputs.append(output)
+            output["userId"] = user_id if output["verified"] else None
         else:
-            outputs.append(
-                {
-                    "verified": False,
-                    "distance": 0.0,
-                    "metric": None,
-                    "threshold": None,
-                    "embedding_model": embedding_name,
-                    "detector_model": detector_name,
-                    "userId": None,
-                }
-            )
-        pointer += len(detected_faces)
+            output = {
+                "verified": False,
+                "distance": 0.0,
+                "metric": None,
+                "threshold": None,
+                "embedding_model": embedding_name,
+                "detector_model": detector_name,
+                "userId": None,
+            }
+        if search_mode == RANGE_SEARCH:
+            output["matches"] = [
+                {"userId": user_id, "distance": round(float(distance), 2)}
+                for distance, user_id in matches[idx]
+            ]
+        outputs.append(output)
     return outputs
 
 
+def _closest_from_search_arrays(distances, indices, face_counts, image_store):
+    """
+    Picks the closest gallery face for every image from raw faiss arrays holding
+    one neighbour per query face, without building per hit result objects.
+    Returns a list with (distance, user_id) or None for each image.
+    """
+    _, user_ids = image_store.lookup(indices)
+    closest_results, pointer = [], 0
+    for count in face_counts:
+        valid = np.flatnonzero(indices[pointer : pointer + count] >= 0) + pointer
+        if len(valid) == 0:
+            closest_results.append(None)
+        else:
+            if image_store.metric == COSINE_SIMILARITY:
+                closest = valid[np.argmax(distances[valid])]
+            else:
+                closest = valid[np.argmin(distances[valid])]
+            closest_results.append((distances[closest], user_ids[closest]))
+        pointer += count
+    return closest_results
+
+
+def _closest_from_search_results(search_results, face_counts, image_store):
+    closest_results, matches, pointer = [], [], 0
+    for count in face_counts:
+        closest_result, _matches = None, []
+        for req_result in search_results[pointer : pointer + count]:
+            for _search in req_result:
+                if _search is None:
+                    continue
+                # hits carry their user id, no store round trip per hit
+                user_id = _search.user_id
+                _matches.append((_search.distance, user_id))
+                if closest_result is None or verify_distance(
+                    _search.distance, closest_result[0], _search.metric_type
+                ):
+                    closest_result = (_search.distance, user_id)
+        closest_results.append(closest_result)
+        matches.append(_matches)
+        pointer += count
+    return closest_results, matches
+
+
 def verify_distance(distance, threshold, metric_type):
     if distance is None:
         return False
@@ -196,19 +267,21 @@ def verify_distance(distance, threshold, metric_type):
     return False
 
 
-def get_distance(vector1, vector2, metric_type):
+def get_distance(vector1, vector2, metric_type, normalized=False):
     if metric_type == COSINE_SIMILARITY:
-        return cosine_similarity(vector1, vector2)
+        return cosine_similarity(vector1, vector2, normalized=normalized)
     if metric_type == EUCLIDEAN_L2:
         return euclidean_distance(vector1, vector2)
     return None
 
 
-def cosine_similarity(vector1, vector2):
+def cosine_similarity(vector1, vector2, normalized=False):
     if not isinstance(vector1, np.ndarray):
         vector1 = np.array(vector1)
-    if not isinstance(vector1, np.ndarray):
+    if not isinstance(vector2, np.ndarray):
         vector2 = np.array(vector2)
+    if normalized:
+        return np.dot(vector1, vector2)
     distance = np.dot(vector1, vector2) / (
         np.linalg.norm(vector1) * np.linalg.norm(vector2)
     )
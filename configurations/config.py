@@ -6,6 +6,7 @@ from dataclasses import dataclass, field
 
 # Internal Imports
 from utils.utils import load_yaml
+from constants.constants import EUCLIDEAN_L2
 
 
 @dataclass
@@ -23,6 +24,40 @@ class StoreConfig:
     arguments: dict = field(default_factory=dict)
 
 
+@dataclass
+class TracingConfig:
+    slow_request_threshold_ms: float = None
+    slow_request_log_path: str = None
+
+
+@dataclass
+class DecodingConfig:
+    # threads decoding the images of a request concurrently, 1 decodes inline
+    workers: int = 4
+
+
+@dataclass
+class ResultCacheConfig:
+    # 0 disables the cache
+    max_bytes: int = 0
+    ttl_seconds: float = 300
+
+
+@dataclass
+class EmbeddingCacheConfig:
+    enabled: bool = False
+    # defaults to <database path>/database/embedding_cache.sqlite
+    path: str = None
+
+
+@dataclass
+class AdminConfig:
+    # token expected as "Authorization: Bearer <token>", admin endpoints are disabled without one
+    token: str = None
+    # frames kept per allocation by tracemalloc for /debug/memory, 0 disables tracing
+    tracemalloc_frames: int = 0
+
+
 @dataclass
 class Configuration:
 
@@ -32,6 +67,16 @@ class Configuration:
 
     image_store: StoreConfig = None
 
+    tracing: TracingConfig = field(default_factory=TracingConfig)
+
+    admin: AdminConfig = field(default_factory=AdminConfig)
+
+    decoding: DecodingConfig = field(default_factory=DecodingConfig)
+
+    result_cache: ResultCacheConfig = field(default_factory=ResultCacheConfig)
+
+    embedding_cache: EmbeddingCacheConfig = field(default_factory=EmbeddingCacheConfig)
+
     database_path: str = None
 
 
@@ -48,9 +93,33 @@ def create_configurations() -> Configuration:
             "image_store": StoreConfig(**config.get("image_store", {})),
             "detector_model": ModelConfig(**config.get("detector_model", {})),
             "embedding_model": ModelConfig(**config.get("embedding_model", {})),
+            "tracing": TracingConfig(**config.get("tracing", {})),
+            "admin": AdminConfig(
+                **{
+                    **config.get("admin", {}),
+                    "token": os.environ.get(
+                        "ADMIN_TOKEN", config.get("admin", {}).get("token", None)
+                    ),
+                }
+            ),
+            "decoding": DecodingConfig(**config.get("decoding", {})),
+            "result_cache": ResultCacheConfig(**config.get("result_cache", {})),
+            "embedding_cache": EmbeddingCacheConfig(
+                **config.get("embedding_cache", {})
+            ),
             "database_path": os.environ.get("DATABASE_PATH", None),
         }
     )
+
+    # euclidean_l2 verification thresholds are distances between raw embeddings
+    metric = config.image_store.arguments.get("indexing_kwargs", {}).get("metric")
+    if config.embedding_model.arguments.get("normalize", False) and (
+        metric == EUCLIDEAN_L2
+    ):
+        raise Exception(
+            f"embedding_model.arguments.normalize cannot be used with {EUCLIDEAN_L2} "
+            f"metric, its thresholds assume raw embeddings"
+        )
     return config
 
 
@@ -1,6 +1,29 @@
 COSINE_SIMILARITY = "cosine_similarity"
 EUCLIDEAN_L2 = "euclidean_l2"
 
+NEAREST_SEARCH = "nearest"
+RANGE_SEARCH = "range"
+
+# MTCNN net precisions, int8 variants run on CPU only
+FP32_PRECISION = "fp32"
+BF16_PRECISION = "bf16"
+INT8_DYNAMIC_PRECISION = "int8_dynamic"
+INT8_STATIC_PRECISION = "int8_static"
+
+EYES_ALIGNMENT = "eyes"
+FIVE_POINT_ALIGNMENT = "five_point"
+# five point alignment warps straight to the FaceNet input size
+FACE_CHIP_SIZE = 160
+# (eye, eye, nose, mouth corner, mouth corner) in MTCNN order, the 112x112 ArcFace
+# reference landmarks, scaled to FACE_CHIP_SIZE when warping
+FIVE_POINT_TEMPLATE = (
+    (38.2946, 51.6963),
+    (73.5318, 51.5014),
+    (56.0252, 71.7366),
+    (41.5493, 92.3655),
+    (70.7299, 92.2041),
+)
+
 
 EMBEDDING_MODEL_DIMENSION = {"FaceNet512": 512, "FaceNet128": 128}
 VERIFICATION_THRESHOLDS = {
@@ -1,5 +1,5 @@
 # Standard Imports
-from typing import List
+from typing import List, Union
 
 # Third Party Imports
 import numpy as np
@@ -15,3 +15,9 @@ class AbstractDetectionModel:
 
     def predict(self, inputs: List[np.ndarray]) -> List[List[FaceSegment]]:
         raise NotImplementedError
+
+    def memory_bytes(self) -> Union[int, None]:
+        """
+        Estimated bytes held by the model weights, None when unknown.
+        """
+        return None
@@ -203,6 +203,12 @@ class MTCNN(nn.Module):
             (default: {False})
         device {torch.device} -- The device on which to run neural net passes. Image tensors and
             models are copied to this device before running forward passes. (default: {None})
+        max_face_size {int} -- Pyramid scales searching only for faces larger than this are
+            skipped. (default: {None})
+        min_face_fraction {float} -- Minimum face size as a fraction of the shorter image side,
+            the larger of this and min_face_size is used. (default: {0.0})
+        packed_pnet {bool} -- Run PNet once over all pyramid levels tiled into one canvas
+            instead of once per level. (default: {False})
     """
 
     def __init__(
@@ -217,12 +223,18 @@ class MTCNN(nn.Module):
         selection_method=None,
         keep_all=False,
         device=None,
+        max_face_size=None,
+        min_face_fraction=0.0,
+        packed_pnet=False,
     ):
         super().__init__()
 
         self.image_size = image_size
         self.margin = margin
         self.min_face_size = min_face_size
+        self.max_face_size = max_face_size
+        self.min_face_fraction = min_face_fraction
+        self.packed_pnet = packed_pnet
         self.thresholds = thresholds
         self.factor = factor
         self.post_process = post_process
@@ -292,7 +304,7 @@ class MTCNN(nn.Module):
         else:
             return faces
 
-    def detect(self, img, landmarks=False):
+    def detect(self, img, landmarks=False, min_face_size=None, max_face_size=None):
         """Detect all faces in PIL image and return bounding boxes and optional facial landmarks.
 
         This method is used by the forward method and is also useful for face detection tasks
@@ -306,6 +318,9 @@ class MTCNN(nn.Module):
         Keyword Arguments:
             landmarks {bool} -- Whether to return facial landmarks in addition to bounding boxes.
                 (default: {False})
+            min_face_size {int} -- Overrides self.min_face_size, and self.min_face_fraction, for
+                this call. (default: {None})
+            max_face_size {int} -- Overrides self.max_face_size for this call. (default: {None})
 
         Returns:
             tuple(numpy.ndarray, list) -- For N detected faces, a tuple containing an
@@ -335,39 +350,35 @@ class MTCNN(nn.Module):
         with torch.no_grad():
             batch_boxes, batch_points = detect_face(
                 img,
-                self.min_face_size,
+                min_face_size or self.min_face_size,
                 self.pnet,
                 self.rnet,
                 self.onet,
                 self.thresholds,
                 self.factor,
                 self.device,
+                maxsize=max_face_size or self.max_face_size,
+                min_fraction=0.0 if min_face_size else self.min_face_fraction,
+                packed=self.packed_pnet,
             )
 
+        # float32 arrays per image, lists of them for a batch
         boxes, probs, points = [], [], []
         for box, point in zip(batch_boxes, batch_points):
-            box = np.array(box)
-            point = np.array(point)
             if len(box) == 0:
                 boxes.append(None)
                 probs.append([None])
                 points.append(None)
-            elif self.select_largest:
+                continue
+            if self.select_largest:
                 box_order = np.argsort(
                     (box[:, 2] - box[:, 0]) * (box[:, 3] - box[:, 1])
                 )[::-1]
                 box = box[box_order]
                 point = point[box_order]
-                boxes.append(box[:, :4])
-                probs.append(box[:, 4])
-                points.append(point)
-            else:
-                boxes.append(box[:, :4])
-                probs.append(box[:, 4])
-                points.append(point)
-        boxes = np.array(boxes, dtype=object)
-        probs = np.array(probs, dtype=object)
-        points = np.array(points, dtype=object)
+            boxes.append(box[:, :4])
+            probs.append(box[:, 4])
+            points.append(point)
 
         if (
             not isinstance(img, (list, tuple))
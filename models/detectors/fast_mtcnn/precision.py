@@ -0,0 +1,126 @@
+# Standard Imports
+import os
+import logging
+from typing import List
+
+# Third Part Imports
+import torch
+import numpy as np
+from torch import nn
+from PIL import Image, ImageOps
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+# Internal Imports
+from constants.constants import (
+    FP32_PRECISION,
+    BF16_PRECISION,
+    INT8_DYNAMIC_PRECISION,
+    INT8_STATIC_PRECISION,
+)
+
+NETS = ("pnet", "rnet", "onet")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+class AutocastNet(nn.Module):
+    """
+    Runs net under autocast to dtype, outputs are cast back to float32 so box
+    regression and NMS keep full precision.
+    """
+
+    def __init__(self, net: nn.Module, dtype=torch.bfloat16):
+        super().__init__()
+        self.net = net
+        self.dtype = dtype
+
+    def forward(self, x):
+        with torch.autocast(x.device.type, dtype=self.dtype):
+            outputs = self.net(x)
+        return tuple(output.float() for output in outputs)
+
+
+class FloatPReLU(nn.PReLU):
+    """
+    PReLU kept in float by static quantization, which only matches nn.PReLU.
+    The quantized PReLU stores its slopes in per tensor quint8 and its error
+    compounds through the nets until PNet finds no faces.
+    """
+
+
+def _float_prelu(net: nn.Module) -> nn.Module:
+    for name, module in list(net.named_children()):
+        if type(module) is nn.PReLU:
+            prelu = FloatPReLU(module.num_parameters)
+            prelu.load_state_dict(module.state_dict())
+            setattr(net, name, prelu)
+        else:
+            _float_prelu(module)
+    return net
+
+
+def calibration_images(path: str, limit=32) -> List[np.ndarray]:
+    """
+    Up to limit RGB images found under path, e.g. the gallery images directory,
+    in sorted order so the calibration is reproducible.
+    """
+    paths = []
+    for root, _, files in os.walk(path):
+        paths.extend(
+            os.path.join(root, name)
+            for name in files
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    images = []
+    for image_path in sorted(paths)[:limit]:
+        try:
+            with Image.open(image_path) as image:
+                images.append(np.array(ImageOps.exif_transpose(image).convert("RGB")))
+        except Exception as e:
+            logging.error(f"Skipping calibration image {image_path}: {str(e)}")
+    return images
+
+
+def set_precision(mtcnn, precision: str, calibration: List[np.ndarray] = None):
+    """
+    Swaps the PNet, RNet and ONet of mtcnn for precision variants:
+    bf16 autocast, int8_dynamic (dynamic int8 Linear layers, so RNet and ONet
+    only, PNet is fully convolutional) or int8_static (int8 convolutions and
+    Linear layers, PReLU in float, with activation ranges observed while
+    detecting calibration).
+    Returns the precision applied, fp32 when precision is not supported here.
+    """
+    if precision == FP32_PRECISION:
+        return precision
+    if precision == BF16_PRECISION:
+        for name in NETS:
+            setattr(mtcnn, name, AutocastNet(getattr(mtcnn, name)))
+        return precision
+
+    if precision not in (INT8_DYNAMIC_PRECISION, INT8_STATIC_PRECISION):
+        raise Exception(f"{precision} detector precision does not exists")
+    if torch.device(mtcnn.device).type != "cpu":
+        logging.error(f"{precision} runs on cpu only, keeping {FP32_PRECISION}")
+        return FP32_PRECISION
+
+    if precision == INT8_DYNAMIC_PRECISION:
+        for name in NETS:
+            net = getattr(mtcnn, name).eval()
+            setattr(mtcnn, name, quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8))
+        return precision
+
+    if not calibration:
+        logging.error(f"no calibration images for {precision}, keeping fp32")
+        return FP32_PRECISION
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    example = (torch.zeros(1, 3, 48, 48),)
+    for name in NETS:
+        net = getattr(mtcnn, name).eval()
+        setattr(mtcnn, name, prepare_fx(_float_prelu(net), qconfig_mapping, example))
+    # observers record activation ranges of every stage on real pyramids and crops
+    for image in calibration:
+        mtcnn.detect(image)
+    for name in NETS:
+        setattr(mtcnn, name, convert_fx(getattr(mtcnn, name)))
+    logging.info(f"MTCNN nets quantized with {len(calibration)} calibration images")
+    return precision
@@ -1,5 +1,7 @@
 # Standard Imports
 import os
+import time
+from functools import lru_cache
 
 # Third Part Imports
 import cv2
@@ -11,6 +13,7 @@ from torchvision.ops.boxes import batched_nms
 from torchvision.transforms import functional as F
 
 # Internal Imports
+from utils.tracing import record_span
 
 
 def fixed_batch_process(im_data, model):
@@ -23,13 +26,162 @@ def fixed_batch_process(im_data, model):
     return tuple(torch.cat(v, dim=0) for v in zip(*out))
 
 
-def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
+@lru_cache(maxsize=64)
+def scale_pyramid(h, w, minsize, factor, maxsize=None, min_fraction=0.0):
+    """
+    PNet scales for an h x w image, a scale s finds faces of about 12 / s pixels.
+    The smallest face is the larger of minsize and min_fraction of the shorter
+    side, scales finding only faces above maxsize are dropped (the first scale
+    reaching maxsize is kept). Cached per input shape and configuration.
+    """
+    minl = min(h, w)
+    minsize = max(minsize, min_fraction * minl)
+    scale_i = 12.0 / minsize
+    minl = minl * scale_i
+
+    scales = []
+    while minl >= 12:
+        scales.append(scale_i)
+        if maxsize and 12.0 / scale_i >= maxsize:
+            break
+        scale_i = scale_i * factor
+        minl = minl * factor
+    return tuple(scales)
+
+
+def detection_bytes(h, w, scales):
+    """
+    Rough peak memory of detect_face on an h x w image: the uint8 copy and float
+    tensor of the input plus the PNet activations of the largest pyramid level.
+    """
+    if len(scales) == 0:
+        return h * w * 15
+    return h * w * 15 + int(h * scales[0] + 1) * int(w * scales[0] + 1) * 64
+
+
+def tile_grid(h, w, tile_size, overlap):
+    """
+    (y0, x0, y1, x1) of tile_size tiles covering an h x w image, neighbouring
+    tiles overlap by at least overlap pixels so any face up to overlap pixels
+    lies entirely inside one tile.
+    """
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        count = int(np.ceil((length - overlap) / (tile_size - overlap)))
+        step = (length - tile_size) / (count - 1)
+        return [int(round(i * step)) for i in range(count)]
+
+    return [
+        (y0, x0, min(y0 + tile_size, h), min(x0 + tile_size, w))
+        for y0 in starts(h)
+        for x0 in starts(w)
+    ]
+
+
+@lru_cache(maxsize=64)
+def pyramid_layout(h, w, scales):
+    """
+    Shelf packing of the pyramid levels of an h x w image into one canvas, the
+    first shelf holds the two largest levels side by side. Offsets are even so
+    PNet output cells (stride 2) line up with the cells of each level on its own.
+    Returns the canvas height, width and (height, width, y, x) of every level.
+    """
+    sizes = [(int(h * scale + 1), int(w * scale + 1)) for scale in scales]
+    canvas_w = sum(size[1] + size[1] % 2 for size in sizes[:2])
+
+    shelves, placements = [], []  # shelves as [y, height, used width]
+    for sh, sw in sizes:
+        for shelf in shelves:
+            if sh <= shelf[1] and shelf[2] + sw <= canvas_w:
+                break
+        else:
+            y = shelves[-1][0] + shelves[-1][1] if shelves else 0
+            shelf = [y, sh + sh % 2, 0]
+            shelves.append(shelf)
+        placements.append((sh, sw, shelf[0], shelf[2]))
+        shelf[2] += sw + sw % 2
+    canvas_h = shelves[-1][0] + shelves[-1][1] if shelves else 0
+    return canvas_h, canvas_w, tuple(placements)
+
+
+def pnet_stage(imgs, scales, pnet, thresh):
+    """
+    Runs PNet once per pyramid scale, returns the candidate boxes and image
+    indices of every scale.
+    """
+    h, w = imgs.shape[2:4]
+    boxes, image_inds = [], []
+    for scale in scales:
+        im_data = imresample(imgs, (int(h * scale + 1), int(w * scale + 1)))
+        im_data.sub_(127.5).mul_(0.0078125)
+        reg, probs = pnet(im_data)
+
+        boxes_scale, image_inds_scale = generateBoundingBox(
+            reg, probs[:, 1], scale, thresh
+        )
+        boxes.append(boxes_scale)
+        image_inds.append(image_inds_scale)
+    return boxes, image_inds
+
+
+def packed_pnet_stage(imgs, scales, pnet, thresh):
+    """
+    pnet_stage with the pyramid levels tiled into one canvas (pyramid_layout) and
+    run in a single PNet pass. The largest level runs on its own, packing it would
+    double the canvas for a level already large enough to keep PNet busy. Output
+    cells are split back per level, keeping only cells whose 12 x 12 window lies
+    inside the level, so the candidates equal pnet_stage except for the partial
+    cells at odd sized level borders.
+    """
+    boxes, image_inds = pnet_stage(imgs, scales[:1], pnet, thresh)
+    scales = tuple(scales[1:])
+    if len(scales) == 0:
+        return boxes, image_inds
+
+    h, w = imgs.shape[2:4]
+    canvas_h, canvas_w, placements = pyramid_layout(int(h), int(w), scales)
+    canvas = imgs.new_zeros((len(imgs), imgs.shape[1], canvas_h, canvas_w))
+    for sh, sw, oy, ox in placements:
+        canvas[:, :, oy : oy + sh, ox : ox + sw] = imresample(imgs, (sh, sw))
+    canvas.sub_(127.5).mul_(0.0078125)
+    reg, probs = pnet(canvas)
+
+    for scale, (sh, sw, oy, ox) in zip(scales, placements):
+        cy, cx = oy // 2, ox // 2
+        ny, nx = (sh - 12) // 2 + 1, (sw - 12) // 2 + 1
+        if ny <= 0 or nx <= 0:
+            continue
+        boxes_scale, image_inds_scale = generateBoundingBox(
+            reg[:, :, cy : cy + ny, cx : cx + nx],
+            probs[:, 1, cy : cy + ny, cx : cx + nx],
+            scale,
+            thresh,
+        )
+        boxes.append(boxes_scale)
+        image_inds.append(image_inds_scale)
+    return boxes, image_inds
+
+
+def detect_face(
+    imgs,
+    minsize,
+    pnet,
+    rnet,
+    onet,
+    threshold,
+    factor,
+    device,
+    maxsize=None,
+    min_fraction=0.0,
+    packed=False,
+):
     if isinstance(imgs, (np.ndarray, torch.Tensor)):
         if isinstance(imgs, np.ndarray):
-            imgs = torch.as_tensor(imgs.copy(), device=device)
-
-        if isinstance(imgs, torch.Tensor):
-            imgs = torch.as_tensor(imgs, device=device)
+            # wraps the caller's buffer, only non contiguous inputs (tiles) are copied
+            imgs = torch.from_numpy(np.ascontiguousarray(imgs))
+        imgs = imgs.to(device)
 
         if len(imgs.shape) == 3:
             imgs = imgs.unsqueeze(0)
@@ -40,49 +192,45 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
             raise Exception(
                 "MTCNN batch processing only compatible with equal-dimension images."
             )
-        imgs = np.stack([np.uint8(img) for img in imgs])
-        imgs = torch.as_tensor(imgs.copy(), device=device)
-
-    model_dtype = next(pnet.parameters()).dtype
-    imgs = imgs.permute(0, 3, 1, 2).type(model_dtype)
+        imgs = torch.from_numpy(np.stack([np.uint8(img) for img in imgs])).to(device)
+
+    # the only full resolution float copy, shared by the pyramid and the RNet and
+    # ONet crops
+    # quantized nets hold no float parameters and take float32 inputs
+    parameter = next(pnet.parameters(), None)
+    model_dtype = (
+        parameter.dtype
+        if parameter is not None and parameter.is_floating_point()
+        else torch.float32
+    )
+    imgs = imgs.permute(0, 3, 1, 2).to(model_dtype)
 
     batch_size = len(imgs)
     h, w = imgs.shape[2:4]
-    m = 12.0 / minsize
-    minl = min(h, w)
-    minl = minl * m
 
     # Create scale pyramid
-    scale_i = m
-    scales = []
-    while minl >= 12:
-        scales.append(scale_i)
-        scale_i = scale_i * factor
-        minl = minl * factor
+    scales = scale_pyramid(int(h), int(w), minsize, factor, maxsize, min_fraction)
+    if len(scales) == 0:
+        # the image is smaller than the smallest face looked for
+        return (
+            [np.zeros((0, 5), dtype=np.float32)] * batch_size,
+            [np.zeros((0, 5, 2), dtype=np.float32)] * batch_size,
+        )
 
     # First stage
-    boxes = []
-    image_inds = []
+    stage_start = time.perf_counter()
+    stage = packed_pnet_stage if packed else pnet_stage
+    boxes, image_inds = stage(imgs, scales, pnet, threshold[0])
 
     scale_picks = []
-
-    all_i = 0
     offset = 0
-    for scale in scales:
-        im_data = imresample(imgs, (int(h * scale + 1), int(w * scale + 1)))
-        im_data = (im_data - 127.5) * 0.0078125
-        reg, probs = pnet(im_data)
-
-        boxes_scale, image_inds_scale = generateBoundingBox(
-            reg, probs[:, 1], scale, threshold[0]
-        )
-        boxes.append(boxes_scale)
-        image_inds.append(image_inds_scale)
-
+    for boxes_scale, image_inds_scale in zip(boxes, image_inds):
         pick = batched_nms(boxes_scale[:, :4], boxes_scale[:, 4], image_inds_scale, 0.5)
         scale_picks.append(pick + offset)
         offset += boxes_scale.shape[0]
 
+    record_span("pnet", stage_start)
+
     boxes = torch.cat(boxes, dim=0)
     image_inds = torch.cat(image_inds, dim=0)
 
@@ -106,6 +254,7 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
     y, ey, x, ex = pad(boxes, w, h)
 
     # Second stage
+    stage_start = time.perf_counter()
     if len(boxes) > 0:
         im_data = []
         for k in range(len(y)):
@@ -115,7 +264,7 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
                 ].unsqueeze(0)
                 im_data.append(imresample(img_k, (24, 24)))
         im_data = torch.cat(im_data, dim=0)
-        im_data = (im_data - 127.5) * 0.0078125
+        im_data.sub_(127.5).mul_(0.0078125)
 
         # This is equivalent to out = rnet(im_data) to avoid GPU out of memory.
         out = fixed_batch_process(im_data, rnet)
@@ -134,7 +283,10 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
         boxes = bbreg(boxes, mv)
         boxes = rerec(boxes)
 
+    record_span("rnet", stage_start)
+
     # Third stage
+    stage_start = time.perf_counter()
     points = torch.zeros(0, 5, 2, device=device)
     if len(boxes) > 0:
         y, ey, x, ex = pad(boxes, w, h)
@@ -146,7 +298,7 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
                 ].unsqueeze(0)
                 im_data.append(imresample(img_k, (48, 48)))
         im_data = torch.cat(im_data, dim=0)
-        im_data = (im_data - 127.5) * 0.0078125
+        im_data.sub_(127.5).mul_(0.0078125)
 
         # This is equivalent to out = onet(im_data) to avoid GPU out of memory.
         out = fixed_batch_process(im_data, onet)
@@ -174,21 +326,15 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
         pick = batched_nms_numpy(boxes[:, :4], boxes[:, 4], image_inds, 0.7, "Min")
         boxes, image_inds, points = boxes[pick], image_inds[pick], points[pick]
 
+    record_span("onet", stage_start)
+
     boxes = boxes.cpu().numpy()
     points = points.cpu().numpy()
 
-    image_inds = image_inds.cpu()
-
-    batch_boxes = []
-    batch_points = []
-    for b_i in range(batch_size):
-        b_i_inds = np.where(image_inds == b_i)
-        batch_boxes.append(boxes[b_i_inds].copy())
-        batch_points.append(points[b_i_inds].copy())
-
-    batch_boxes, batch_points = np.array(batch_boxes, dtype=object), np.array(
-        batch_points, dtype=object
-    )
+    # per image float32 arrays, images have different numbers of faces
+    image_inds = image_inds.cpu().numpy()
+    batch_boxes = [boxes[image_inds == b_i] for b_i in range(batch_size)]
+    batch_points = [points[image_inds == b_i] for b_i in range(batch_size)]
 
     return batch_boxes, batch_points
 
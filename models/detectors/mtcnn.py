@@ -1,15 +1,36 @@
 # Standard Imports
+import os
 import logging
 from typing import List, Union
 
 # Third Party Imports
+import cv2
 import torch
 import numpy as np
 
 # Internal Imports
 from structures.image import FaceSegment
 from models.detectors.fast_mtcnn.model import MTCNN
+from models.detectors.fast_mtcnn.utils import (
+    scale_pyramid,
+    detection_bytes,
+    tile_grid,
+    nms_numpy,
+)
 from models.detectors import AbstractDetectionModel
+from configurations.config import app_config
+from constants.constants import DEFAULT_DATABASE_PATH, FP32_PRECISION
+from models.detectors.fast_mtcnn.precision import set_precision, calibration_images
+
+
+def _tensor_bytes(value) -> int:
+    # quantized Linear layers store their int8 weight and bias as a
+    # _packed_params (weight, bias) tuple in the state dict
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item) for item in value)
+    return 0
 
 
 class FastMtcnn(AbstractDetectionModel):
@@ -18,15 +39,43 @@ class FastMtcnn(AbstractDetectionModel):
         self.device = kwargs.get(
             "device", "cuda" if torch.cuda.is_available() else "cpu"
         )
+        # scale pyramid limits, in pixels of the detection input
+        self.min_face_size = kwargs.get("min_face_size") or 20
+        self.max_face_size = kwargs.get("max_face_size")
+        self.min_face_fraction = kwargs.get("min_face_fraction") or 0.0
+        self.factor = kwargs.get("factor") or 0.709
+        self.packed_pnet = kwargs.get("packed_pnet", False)
+        # tiled detection of large images, by tile side or by peak memory
+        self.tile_size = kwargs.get("tile_size")
+        self.tile_overlap = kwargs.get("tile_overlap") or 256
+        self.max_detection_bytes = kwargs.get("max_detection_bytes")
+        # fp32, bf16, int8_dynamic or int8_static calibrated on gallery images
+        self.precision = kwargs.get("precision") or FP32_PRECISION
+        self.calibration_path = kwargs.get("calibration_path")
+        self.calibration_size = kwargs.get("calibration_size") or 32
         self.model = None
 
     def load(self, model_path: Union[str, None]):
-        self.model = MTCNN(device=self.device)
+        self.model = MTCNN(
+            min_face_size=self.min_face_size,
+            factor=self.factor,
+            device=self.device,
+            max_face_size=self.max_face_size,
+            min_face_fraction=self.min_face_fraction,
+            packed_pnet=self.packed_pnet,
+        )
+        calibration = None
+        if self.precision != FP32_PRECISION:
+            calibration_path = self.calibration_path or os.path.join(
+                app_config.database_path or DEFAULT_DATABASE_PATH, "database", "images"
+            )
+            calibration = calibration_images(calibration_path, self.calibration_size)
+        self.precision = set_precision(self.model, self.precision, calibration)
 
     def predict(self, inputs: List[np.ndarray]) -> List[List[FaceSegment]]:
         outputs = []
         for image in inputs:
-            detections = self.model.detect(image, landmarks=True)
+            detections = self._detect(image)
             detected_faces = []
 
             if detections is None or detections[0] is None:
@@ -34,10 +83,10 @@ class FastMtcnn(AbstractDetectionModel):
                 logging.error("No faces detected")
                 continue
 
-            for regions, confidence, eyes in zip(*detections):
-                x, y, w, h = self._xyxy_to_xywh(regions)
-                right_eye = eyes[0]
-                left_eye = eyes[1]
+            for regions, confidence, points in zip(*detections):
+                x, y, w, h = (float(i) for i in self._xyxy_to_xywh(regions))
+                right_eye = points[0]
+                left_eye = points[1]
 
                 left_eye = tuple(int(i) for i in left_eye)
                 right_eye = tuple(int(i) for i in right_eye)
@@ -49,12 +98,142 @@ class FastMtcnn(AbstractDetectionModel):
                         h,
                         left_eye,
                         right_eye,
-                        confidence,
+                        float(confidence),
+                        landmarks=[[float(px), float(py)] for px, py in points],
                     )
                 )
             outputs.append(detected_faces)
         return outputs
 
+    def _tile_size(self, h, w, min_face_size, max_face_size):
+        """
+        Tile side for an h x w image, None when it is detected whole. Images above
+        tile_size are tiled, as are images whose detection would exceed
+        max_detection_bytes, with the largest square tile fitting that budget.
+        """
+        tile = self.tile_size
+        if self.max_detection_bytes:
+            scales = scale_pyramid(h, w, min_face_size, self.factor, max_face_size)
+            if detection_bytes(h, w, scales) > self.max_detection_bytes:
+                per_pixel = 15 + 64 * (12.0 / min_face_size) ** 2
+                budget_tile = int(np.sqrt(self.max_detection_bytes / per_pixel))
+                tile = min(tile or budget_tile, budget_tile)
+        if tile is None or max(h, w) <= tile:
+            return None
+        # a tile must hold faces of twice the minimum size to be of any use
+        return max(int(tile), 4 * int(np.ceil(min_face_size)))
+
+    def _detect(self, image, min_face_size=None, max_face_size=None):
+        """
+        Faces of image as MTCNN.detect boxes, probabilities and landmarks. Large
+        images are tiled: tiles overlapping by tile_overlap find the faces up to
+        that size, larger faces are found on a copy downscaled by
+        min_face_size / tile_overlap (itself tiled when still too large), and the
+        results are merged with NMS in full resolution coordinates.
+        """
+        h, w = image.shape[:2]
+        if min_face_size is None:
+            min_face_size = max(self.min_face_size, self.min_face_fraction * min(h, w))
+        if max_face_size is None:
+            max_face_size = self.max_face_size
+
+        tile = self._tile_size(h, w, min_face_size, max_face_size)
+        if tile is None:
+            return self.model.detect(
+                image,
+                landmarks=True,
+                min_face_size=min_face_size,
+                max_face_size=max_face_size,
+            )
+
+        overlap = max(min(self.tile_overlap, tile // 2), 2 * min_face_size)
+        tile_max_face = min(max_face_size or overlap, overlap)
+        if self.max_detection_bytes and (
+            self.tile_size is None or tile < self.tile_size
+        ):
+            logging.warning(
+                f"Detection of a {w}x{h} image exceeds max_detection_bytes, detecting "
+                f"in {tile} px tiles: faces above {int(overlap)} px are only searched "
+                f"on a downscaled copy with a minimum face size of {int(overlap)} px, "
+                f"which can miss faces found without the budget"
+            )
+        parts = []
+        for y0, x0, y1, x1 in tile_grid(h, w, tile, int(overlap)):
+            boxes, probs, points = self._as_arrays(
+                self.model.detect(
+                    image[y0:y1, x0:x1],
+                    landmarks=True,
+                    min_face_size=min_face_size,
+                    max_face_size=tile_max_face,
+                )
+            )
+            # faces cut by an inner tile border lie whole in the neighbouring tile
+            inside = (
+                ((x0 == 0) | (boxes[:, 0] > 1))
+                & ((y0 == 0) | (boxes[:, 1] > 1))
+                & ((x1 == w) | (boxes[:, 2] < x1 - x0 - 1))
+                & ((y1 == h) | (boxes[:, 3] < y1 - y0 - 1))
+            )
+            offset = np.array([x0, y0], dtype=np.float32)
+            parts.append(
+                (
+                    boxes[inside] + np.tile(offset, 2),
+                    probs[inside],
+                    points[inside] + offset,
+                )
+            )
+
+        # faces larger than the overlap need a short side of at least the overlap,
+        # below it the downscaled copy could not even hold a min_face_size face
+        if (max_face_size is None or max_face_size > overlap) and min(h, w) >= overlap:
+            ratio = min_face_size / overlap
+            small = cv2.resize(
+                image,
+                (max(1, int(round(w * ratio))), max(1, int(round(h * ratio)))),
+                interpolation=cv2.INTER_AREA,
+            )
+            boxes, probs, points = self._as_arrays(
+                self._detect(
+                    small,
+                    min_face_size=min_face_size,
+                    max_face_size=max_face_size * ratio if max_face_size else None,
+                )
+            )
+            parts.append((boxes / ratio, probs, points / ratio))
+
+        boxes = np.concatenate([part[0] for part in parts])
+        probs = np.concatenate([part[1] for part in parts])
+        points = np.concatenate([part[2] for part in parts])
+        if len(boxes) == 0:
+            return None, [None], None
+
+        # faces found in two tiles, or in a tile and the downscaled copy
+        pick = nms_numpy(boxes, probs, 0.7, "Min")
+        boxes, probs, points = boxes[pick], probs[pick], points[pick]
+        order = np.argsort((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))
+        order = order[::-1]
+        return boxes[order], probs[order], points[order]
+
+    @staticmethod
+    def _as_arrays(detections):
+        boxes, probs, points = detections
+        if boxes is None:
+            return (
+                np.zeros((0, 4), dtype=np.float32),
+                np.zeros((0,), dtype=np.float32),
+                np.zeros((0, 5, 2), dtype=np.float32),
+            )
+        return (
+            np.asarray(boxes, dtype=np.float32),
+            np.asarray(probs, dtype=np.float32),
+            np.asarray(points, dtype=np.float32),
+        )
+
+    def memory_bytes(self):
+        if self.model is None:
+            return 0
+        return sum(_tensor_bytes(value) for value in self.model.state_dict().values())
+
     @staticmethod
     def _xyxy_to_xywh(regions):
         """
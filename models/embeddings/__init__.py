@@ -1,5 +1,5 @@
 # Standard Imports
-from typing import List
+from typing import List, Union
 
 # Third Party Imports
 import numpy as np
@@ -8,9 +8,19 @@ import numpy as np
 
 
 class AbstractEmbeddingModel:
+    # whether predict returns L2 normalized embeddings
+    normalize: bool = False
+    # identifies the weights, embeddings persisted under another version are recomputed
+    version: str = None
 
     def load(self, model_path=None):
         raise NotImplementedError
 
     def predict(self, inputs: List[np.ndarray]) -> List[np.ndarray]:
         raise NotImplementedError
+
+    def memory_bytes(self) -> Union[int, None]:
+        """
+        Estimated bytes held by the model weights, None when unknown.
+        """
+        return None
@@ -1,6 +1,7 @@
 # Standard Imports
 import logging
 import os
+from threading import Lock
 import numpy as np
 from typing import List
 
@@ -21,7 +22,9 @@ from tensorflow.keras.layers import add
 from tensorflow.keras import backend as K
 
 # Internal Imports
-from utils.image_utils import resize_image
+from utils.tracing import span
+from utils.utils import normalize_vectors, file_digest
+from utils.image_utils import letterbox_into
 from models.embeddings import AbstractEmbeddingModel
 
 
@@ -31,9 +34,13 @@ class FaceNet512(AbstractEmbeddingModel):
         self.device = kwargs.get(
             "device", "cuda" if torch.cuda.is_available() else "cpu"
         )
+        self.normalize = kwargs.get("normalize", False)
+        self.batch_size = kwargs.get("batch_size", 32)
         self.model = None
         self.input_shape = (160, 160)
         self.output_shape = 512
+        self._batch_buffer = None
+        self._batch_lock = Lock()
 
     def load(self, model_path=None):
         self.model = InceptionResNetV1(dimension=512)
@@ -45,20 +52,48 @@ class FaceNet512(AbstractEmbeddingModel):
                 f"Loading pretrained face net 512 model weights from {model_path}"
             )
         self.model.load_weights(model_path)
+        # normalized and raw embeddings must never be mixed in the embedding cache
+        self.version = (
+            f"FaceNet512:{file_digest(model_path)[:16]}:normalize={self.normalize}"
+        )
+
+    def memory_bytes(self):
+        if self.model is None:
+            return 0
+        return sum(
+            int(np.prod(weight.shape)) * weight.dtype.size
+            for weight in self.model.weights
+        )
+
+    def preprocess(self, inputs: List[np.ndarray]) -> np.ndarray:
+        """
+        Letterboxes uint8 face crops into the preallocated float32 batch buffer,
+        BGR ordered and scaled to [0, 1]. The returned batch is a view of the buffer
+        and is overwritten by the next call.
+        """
+        height, width = self.input_shape[1], self.input_shape[0]
+        if self._batch_buffer is None or len(self._batch_buffer) < len(inputs):
+            self._batch_buffer = np.zeros(
+                (max(len(inputs), self.batch_size), height, width, 3), dtype=np.float32
+            )
+        batch = self._batch_buffer[: len(inputs)]
+        batch.fill(0)
+        for idx, image in enumerate(inputs):
+            letterbox_into(image, batch[idx], reverse_channels=True)
+        return batch
 
     def predict(self, inputs: List[np.ndarray]) -> List[np.ndarray]:
         embeddings = []
 
-        for image in inputs:
-            image = image[:, :, ::-1]
+        with self._batch_lock:
+            for start in range(0, len(inputs), self.batch_size):
+                with span("facenet_preprocess"):
+                    batch = self.preprocess(inputs[start : start + self.batch_size])
+                with span("facenet"):
+                    embeddings.extend(self.model(batch, training=False).numpy())
 
-            image = resize_image(
-                img=image,
-                # thanks to DeepId (!)
-                target_size=(self.input_shape[1], self.input_shape[0]),
-            )
-            embedding = self.model(image, training=False).numpy()[0].tolist()
-            embeddings.append(embedding)
+        if self.normalize and len(embeddings) > 0:
+            embeddings = list(normalize_vectors(embeddings))
         return embeddings
 
 
@@ -83,6 +118,9 @@ class FaceNet128(FaceNet512):
                 f"Loading pretrained face net 128 model weights from {model_path}"
             )
         self.model.load_weights(model_path)
+        self.version = (
+            f"FaceNet128:{file_digest(model_path)[:16]}:normalize={self.normalize}"
+        )
 
 
 def scaling(x, scale):
@@ -33,3 +33,7 @@ class ModelHolder(object):
         if model_name not in ModelHolder._last_load_time:
             ModelHolder._last_load_time[model_name] = time.time()
             ModelHolder._model_holder[model_name].load(model_path)
+
+    @staticmethod
+    def get_models():
+        return dict(ModelHolder._model_holder)
@@ -8,10 +8,11 @@ import logging
 # Internal Imports
 from stores import AbstractStoreBuilder
 from structures.image import ImageMetadata
-from components.embeddings import represent
+from components.embeddings import represent, reembed
 from configurations.config import app_config
 from utils.utils import load_json, load_pickle
 from stores.image_store import ImageMetadataStore
+from stores.sharded_store import ShardedImageMetadataStore
 from constants.constants import DEFAULT_DATABASE_PATH
 
 
@@ -41,12 +42,21 @@ class ImageMetadataStoreBuilder(AbstractStoreBuilder):
             self._image_store = ImageMetadataStore([], **kwargs)
             return self._image_store
 
-        rebuild = kwargs.get("rebuild", False)
+        image_metadata = self._load_image_metadata(
+            base_path, [self.store_path], kwargs.get("rebuild", False)
+        )
+        self._image_store = ImageMetadataStore(image_metadata, **kwargs)
+        logging.info(f"image metadata successfully loaded from {self.store_path}")
+        return self._image_store
+
+    def _load_image_metadata(self, base_path: str, metadata_paths, rebuild=False):
         # When base path exists
-        image_metadata = []
-        if os.path.exists(self.store_path) and not rebuild:
+        image_metadata, existing_hashes = [], set()
+        for metadata_path in metadata_paths:
+            if not os.path.exists(metadata_path) or rebuild:
+                continue
             try:
-                metadata = load_pickle(self.store_path)
+                metadata = load_pickle(metadata_path)
             except Exception as e:
                 logging.error("Error in loading metadata json: {}".format(str(e)))
                 # setting metadata as empty list, since metadata json was corrupted
@@ -67,9 +77,14 @@ class ImageMetadataStoreBuilder(AbstractStoreBuilder):
                     logging.warning(
                         "image path {} does not exists. please check if the base path is correct"
                     )
-                else:
+                elif metadata.hash_key not in existing_hashes:
+                    existing_hashes.add(metadata.hash_key)
                     image_metadata.append(metadata)
 
+        # faces stored for another embedding model only need the new model, not detection
+        if app_config.embedding_model and len(image_metadata) > 0:
+            reembed(image_metadata, app_config.embedding_model.name)
+
         # Following logics check if their any image not present in metadata
         expected_images_path = os.path.join(base_path, "database", "images", "*", "*")
         image_paths = (
@@ -92,13 +107,8 @@ class ImageMetadataStoreBuilder(AbstractStoreBuilder):
                 images=image_paths,
                 embedding_name=app_config.embedding_model.name,
                 detector_name=app_config.detector_model.name,
-                align=app_config.detector_model.arguments.get("align", False),
-                expand_percentage=app_config.detector_model.arguments.get(
-                    "expand_percentage", 0
-                ),
-                confidence_threshold=app_config.detector_model.arguments.get(
-                    "confidence_threshold", 0.85
-                ),
+                # the same arguments as /add, so both compute the same cache keys
+                **app_config.detector_model.arguments,
             )
             for idx, detected_faces in enumerate(representations):
                 if len(detected_faces) == 0:
@@ -117,6 +127,32 @@ class ImageMetadataStoreBuilder(AbstractStoreBuilder):
                     )
                 )
 
-        self._image_store = ImageMetadataStore(image_metadata, **kwargs)
-        logging.info(f"image metadata successfully loaded from {self.store_path}")
+        return image_metadata
+
+
+class ShardedImageMetadataStoreBuilder(ImageMetadataStoreBuilder):
+
+    def load(self, base_path: str, **kwargs):
+        if base_path is None:
+            logging.warning(
+                f"Database Path is None, using {DEFAULT_DATABASE_PATH} as temporary database storage"
+            )
+            base_path = DEFAULT_DATABASE_PATH
+
+        if not os.path.exists(os.path.join(base_path, "database")):
+            os.makedirs(os.path.join(base_path, "database"), exist_ok=True)
+
+        self.store_path = os.path.join(base_path, "database", "metadata.pickle")
+        kwargs.update({"store_path": self.store_path})
+
+        # every shard dumps its own metadata file, unsharded metadata is read last
+        metadata_paths = sorted(
+            glob.glob(os.path.join(base_path, "database", "metadata_shard_*.pickle"))
+        ) + [self.store_path]
+        image_metadata = self._load_image_metadata(
+            base_path, metadata_paths, kwargs.get("rebuild", False)
+        )
+
+        self._image_store = ShardedImageMetadataStore(image_metadata, **kwargs)
+        logging.info(f"sharded image metadata successfully loaded from {base_path}")
         return self._image_store
@@ -0,0 +1,183 @@
+# Standard Imports
+import os
+import time
+import pickle
+import sqlite3
+import logging
+from threading import Lock
+from typing import List, Dict
+
+# Third Party Imports
+import numpy as np
+
+# Internal Imports
+from configurations.config import app_config
+from structures.image import DetectedFace, FaceSegment
+from constants.constants import DEFAULT_DATABASE_PATH, EYES_ALIGNMENT
+from utils.metrics import CACHE_REQUESTS
+
+
+class EmbeddingCache:
+    """
+    SQLite backed cache of face segments and float32 embeddings, keyed by image key
+    (image content hash plus detector config), embedding model and model version. It
+    lives next to the image database so /re-index and rebuilds skip decoding images
+    whose embeddings are already known.
+    """
+
+    def __init__(self, name: str, path: str = None, enabled=False):
+        self.name = name
+        self.path = path
+        self.enabled = enabled
+        self._connection = None
+        self._lock = Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            if self.path is None:
+                self.path = os.path.join(
+                    app_config.database_path or DEFAULT_DATABASE_PATH,
+                    "database",
+                    "embedding_cache.sqlite",
+                )
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "image_key TEXT, embedding_model TEXT, model_version TEXT, "
+                "faces BLOB, created REAL, "
+                "PRIMARY KEY (image_key, embedding_model, model_version))"
+            )
+            self._connection.commit()
+            logging.info(f"embedding cache opened at {self.path}")
+        return self._connection
+
+    def get_many(
+        self, image_keys: List[str], embedding_name: str, model_version: str
+    ) -> Dict[str, List[DetectedFace]]:
+        """
+        Faces of every image key found in the cache, keys missing from the cache
+        are missing from the returned dict.
+        """
+        image_keys = [key for key in image_keys if key is not None]
+        if not self.enabled or len(image_keys) == 0:
+            return {}
+
+        rows = []
+        with self._lock:
+            connection = self._connect()
+            # sqlite limits the number of bound parameters per statement
+            for start in range(0, len(image_keys), 500):
+                chunk = image_keys[start : start + 500]
+                rows.extend(
+                    connection.execute(
+                        "SELECT image_key, faces FROM embeddings "
+                        "WHERE embedding_model = ? AND model_version = ? "
+                        f"AND image_key IN ({','.join('?' * len(chunk))})",
+                        [embedding_name, str(model_version), *chunk],
+                    ).fetchall()
+                )
+
+        results = {
+            image_key: self._deserialize(faces, embedding_name)
+            for image_key, faces in rows
+        }
+        CACHE_REQUESTS.inc(len(results), cache=self.name, result="hit")
+        CACHE_REQUESTS.inc(
+            len(image_keys) - len(results), cache=self.name, result="miss"
+        )
+        return results
+
+    def put_many(
+        self,
+        entries: Dict[str, List[DetectedFace]],
+        embedding_name: str,
+        model_version: str,
+    ):
+        entries = {key: faces for key, faces in entries.items() if key is not None}
+        if not self.enabled or len(entries) == 0:
+            return
+
+        created = time.time()
+        rows = [
+            (
+                image_key,
+                embedding_name,
+                str(model_version),
+                self._serialize(faces, embedding_name),
+                created,
+            )
+            for image_key, faces in entries.items()
+        ]
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows
+            )
+            connection.commit()
+
+    @staticmethod
+    def _serialize(faces: List[DetectedFace], embedding_name) -> bytes:
+        return pickle.dumps(
+            [
+                {
+                    "model_name": face.model_name,
+                    "face_segments": face.facial_segments.to_json(),
+                    "alignment": face.alignment,
+                    "alignment_mode": face.alignment_mode,
+                    "expand_percentage": face.expand_percentage,
+                    "embedding": np.asarray(
+                        face.get_embedding(embedding_name), dtype=np.float32
+                    ).tobytes(),
+                    "normalized": face.is_normalized(embedding_name),
+                }
+                for face in faces
+            ],
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+
+    @staticmethod
+    def _deserialize(data: bytes, embedding_name) -> List[DetectedFace]:
+        faces = []
+        for face in pickle.loads(data):
+            detected_face = DetectedFace(
+                model_name=face["model_name"],
+                facial_segments=FaceSegment.from_json(face["face_segments"]),
+                alignment=face["alignment"],
+                alignment_mode=face.get("alignment_mode", EYES_ALIGNMENT),
+                expand_percentage=face["expand_percentage"],
+            )
+            detected_face.add_embedding(
+                embedding_name,
+                np.frombuffer(face["embedding"], dtype=np.float32).copy(),
+                normalized=face["normalized"],
+            )
+            faces.append(detected_face)
+        return faces
+
+    def stats(self) -> dict:
+        if not self.enabled or self._connection is None:
+            return {"enabled": self.enabled, "entries": 0, "bytes": 0}
+        with self._lock:
+            (entries,) = self._connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "bytes": os.path.getsize(self.path),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+embedding_cache = EmbeddingCache(
+    "embeddings",
+    path=app_config.embedding_cache.path,
+    enabled=app_config.embedding_cache.enabled,
+)
@@ -1,8 +1,10 @@
 # Standard Imports
+import sys
 import logging
 import time
 import asyncio
 from threading import Thread
+from dataclasses import replace
 from typing import List, Union
 
 # Third Party Imports
@@ -20,6 +22,66 @@ from constants.constants import (
 from structures.image import ImageMetadata, ImageVectorMetadata, FaissSearchResult
 
 
+def faiss_index_bytes(index) -> int:
+    """
+    Estimated memory held by a faiss index, computed from its codes and graph or
+    inverted list structure instead of serializing (and so copying) the index.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap2):
+        # id map plus the reverse hash map
+        return faiss_index_bytes(index.index) + index.ntotal * 24
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss_index_bytes(index.index) + index.ntotal * 8
+    if isinstance(index, faiss.IndexPreTransform):
+        return faiss_index_bytes(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        return (
+            faiss_index_bytes(index.storage)
+            + hnsw.neighbors.size() * 4
+            + hnsw.levels.size() * 4
+            + hnsw.offsets.size() * 8
+        )
+
+    index_bytes = 0
+    if hasattr(index, "pq"):
+        index_bytes += index.pq.centroids.size() * 4
+    if isinstance(index, faiss.IndexIVF):
+        if index.direct_map.type != faiss.DirectMap.NoMap:
+            # direct map holds a 64 bit list position per vector
+            index_bytes += index.ntotal * 8
+        # every inverted list entry stores its code and a 64 bit id
+        return (
+            index_bytes
+            + faiss_index_bytes(index.quantizer)
+            + index.ntotal * (index.code_size + 8)
+        )
+    return index_bytes + index.ntotal * getattr(index, "code_size", index.d * 4)
+
+
+def training_centroids(index) -> int:
+    """
+    Largest number of centroids trained by an index, its minimum training set size.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        return training_centroids(index.index)
+    centroids = 1
+    if isinstance(index, faiss.IndexIVF):
+        centroids = index.nlist
+    if hasattr(index, "pq"):
+        centroids = max(centroids, index.pq.ksub)
+    return centroids
+
+
+def _embedding_bytes(embedding) -> int:
+    if isinstance(embedding, np.ndarray):
+        return embedding.nbytes
+    # python lists hold a pointer plus a boxed 24 byte float per element
+    return sys.getsizeof(embedding) + len(embedding) * 24
+
+
 class ImageMetadataStore:
 
     def __init__(self, image_metadata: List[ImageMetadata], **kwargs):
@@ -34,19 +96,53 @@ class ImageMetadataStore:
         self._index_type = _indexing_kwargs.get("index_type", "Flat")
         self._metric = _indexing_kwargs.get("metric", COSINE_SIMILARITY)
         self._embedding_model = _indexing_kwargs.get("embedding_model", "FaceNet512")
+        # e.g. {"nprobe": 16} for IVF or {"efSearch": 64} for HNSW index types
+        self._search_parameters = _indexing_kwargs.get("search_parameters", {})
+        # IVF and PQ index types are searched exactly until this many vectors are
+        # added, then trained on them, 39 per centroid by default as faiss advises
+        self._min_training_vectors = _indexing_kwargs.get("min_training_vectors")
+        self._untrained_faiss = None
         self._vector_index_metadata = []
+        # object arrays grown by doubling, slots past the vector count hold None so
+        # the last slot resolves -1 (miss) indices
+        self._vector_hash_keys = np.full(1, None, dtype=object)
+        self._vector_user_ids = np.full(1, None, dtype=object)
         self._faiss = None
+
+        # Identity indexing arguments, identity index holds one centroid per user
+        # and is used to shortlist users before reranking against their faces, the
+        # rerank reconstructs the faces from the face level index so only the
+        # centroids are held on top of it
+        self.identity_indexing = self.vector_indexing and kwargs.get(
+            "identity_indexing", False
+        )
+        _identity_indexing_kwargs = kwargs.get("identity_indexing_kwargs", {})
+        self._identity_candidates = _identity_indexing_kwargs.get("candidates", 5)
+        self._user_vs_identity = {}
+        # (identities, dimension) float32 sums grown by doubling
+        self._identity_sums = np.zeros(
+            (0, EMBEDDING_MODEL_DIMENSION[self._embedding_model]), dtype=np.float32
+        )
+        self._identity_counts = np.zeros(0, dtype=np.int64)
+        # int64 vector indices of every identity's faces
+        self._identity_vs_vector_indices = []
+        self._identity_faiss = None
+
         if self.vector_indexing:
             self._build_index()
 
         # Store dumping thread initializer
         self._store_path = kwargs.get("store_path", None)
+        self._dump_in_progress = False
+        self._last_dump_seconds = 0.0
         if self._store_path:
             _dumping_kwargs = kwargs.get("dumping_kwargs", {})
-            self._dump_in_progress = False
             self._dump_loop_stop_event = asyncio.Event()
             self._dump_thread = Thread(
-                target=self._dump_loop, args=(self._dump_loop_stop_event,), daemon=True
+                target=self._dump_loop,
+                args=(self._dump_loop_stop_event,),
+                name="image-store-dump",
+                daemon=True,
             ).start()
             self._dumping_interval = _dumping_kwargs.get("interval", 300)
 
@@ -84,6 +180,27 @@ class ImageMetadataStore:
         else:
             self._faiss = faiss.index_factory(dimension, self._index_type)
 
+        parameter_space = faiss.ParameterSpace()
+        for name, value in self._search_parameters.items():
+            parameter_space.set_index_parameter(self._faiss, name, value)
+
+        if not self._faiss.is_trained:
+            # centroids trained on the first few faces would be kept for good
+            if self._min_training_vectors is None:
+                self._min_training_vectors = 39 * training_centroids(self._faiss)
+            self._untrained_faiss = self._faiss
+            if self._metric == COSINE_SIMILARITY:
+                self._faiss = faiss.IndexFlatIP(dimension)
+            else:
+                self._faiss = faiss.IndexFlatL2(dimension)
+
+        if self.identity_indexing:
+            # IDMap2 allows replacing a user's centroid in place on every add
+            if self._metric == COSINE_SIMILARITY:
+                self._identity_faiss = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+            else:
+                self._identity_faiss = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
     def _create_vector_metadata_from_image_metadata(
         self, image_metadata: ImageMetadata
     ):
@@ -95,6 +212,7 @@ class ImageMetadataStore:
                     embedding_model=self._embedding_model,
                     image_hash_key=image_metadata.hash_key,
                     embedding=face.get_embedding(self._embedding_model),
+                    normalized=face.is_normalized(self._embedding_model),
                 )
             )
         return vectors_metadata
@@ -107,50 +225,390 @@ class ImageMetadataStore:
             vectors_metadata.extend(
                 self._create_vector_metadata_from_image_metadata(metadata)
             )
+        offset = len(self._vector_index_metadata)
         self._vector_index_metadata.extend(vectors_metadata)
-        self._add_vectors_to_index([meta.embedding for meta in vectors_metadata])
+        self._extend_lookup(offset, vectors_metadata)
+        self._add_vectors_to_index(
+            [meta.embedding for meta in vectors_metadata],
+            normalized=all(meta.normalized for meta in vectors_metadata),
+        )
         assert len(self._vector_index_metadata) == self._faiss.ntotal
 
-    def _add_vectors_to_index(self, vectors: List[np.ndarray]):
-        if len(vectors) == 0:
-            return
+        if self.identity_indexing:
+            self._add_to_identity_index(vectors_metadata, offset)
+
+    def _extend_lookup(self, offset: int, vectors_metadata: List[ImageVectorMetadata]):
+        end = offset + len(vectors_metadata)
+        capacity = len(self._vector_hash_keys)
+        if end >= capacity:
+            capacity = max(2 * capacity, end + 1)
+            for name in ["_vector_hash_keys", "_vector_user_ids"]:
+                grown = np.full(capacity, None, dtype=object)
+                grown[:offset] = getattr(self, name)[:offset]
+                setattr(self, name, grown)
+        for idx, vector_metadata in enumerate(vectors_metadata, start=offset):
+            self._vector_hash_keys[idx] = vector_metadata.image_hash_key
+            self._vector_user_ids[idx] = self._hash_vs_images[
+                vector_metadata.image_hash_key
+            ].user_id
+
+    def _prepare_vectors(self, vectors, normalized=False) -> np.ndarray:
         vectors = np.array(vectors, dtype=np.float32)
-        if self._metric in [COSINE_SIMILARITY]:
+        if self._metric in [COSINE_SIMILARITY] and not normalized:
             vectors = normalize_vectors(vectors)
-        self._faiss.add(vectors)
+        return vectors
+
+    def _add_vectors_to_index(self, vectors: List[np.ndarray], normalized=False):
+        if len(vectors) == 0:
+            return
+        self._faiss.add(self._prepare_vectors(vectors, normalized))
         logging.info("Faiss index size: {}".format(self._faiss.ntotal))
+        if (
+            self._untrained_faiss is not None
+            and self._faiss.ntotal >= self._min_training_vectors
+        ):
+            self.train()
 
-    def search(self, queries, nearest_neighbours=3):
-        if self._faiss is None:
-            raise Exception("Make sure vectors indexing is enabled")
-        if self._faiss.ntotal == 0:
+    def add_vectors(self, vectors: List[np.ndarray], normalized=False):
+        """
+        Adds vectors to the faiss index only, without image metadata, so their hits
+        cannot be resolved by lookup or search. Meant for index benchmarks, a store
+        given vectors this way must not be given images afterwards.
+        """
+        self._add_vectors_to_index(vectors, normalized=normalized)
+
+    def train(self, vectors: List[np.ndarray] = None, normalized=False):
+        """
+        Trains an IVF or PQ index type on an explicit training set, or on the
+        vectors added so far, and moves the added vectors from the exact stand-in
+        index into it. Index types needing no training are left unchanged.
+        Args:
+            vectors (list or np.ndarray): training vectors, the added vectors if None
+            normalized (bool): training vectors are already L2 normalized
+        """
+        if self._untrained_faiss is None:
+            return
+        added = self._faiss.reconstruct_n(0, self._faiss.ntotal)
+        vectors = (
+            added if vectors is None else self._prepare_vectors(vectors, normalized)
+        )
+        centroids = training_centroids(self._untrained_faiss)
+        if len(vectors) < centroids:
+            raise Exception(
+                f"{self._index_type} index needs at least {centroids} training "
+                f"vectors, got {len(vectors)}"
+            )
+
+        logging.info(f"Training {self._index_type} index on {len(vectors)} vectors")
+        self._untrained_faiss.train(vectors)
+        if self.identity_indexing:
+            # identity rerank reconstructs faces by vector index
+            try:
+                faiss.extract_index_ivf(self._untrained_faiss).make_direct_map()
+            except RuntimeError:
+                pass
+        if len(added) > 0:
+            self._untrained_faiss.add(added)
+        self._faiss, self._untrained_faiss = self._untrained_faiss, None
+
+    def _add_to_identity_index(
+        self, vectors_metadata: List[ImageVectorMetadata], offset: int
+    ):
+        updated_identities = {}
+        for idx, vector_metadata in enumerate(vectors_metadata):
+            if vector_metadata.embedding is None:
+                continue
+            user_id = self._hash_vs_images[vector_metadata.image_hash_key].user_id
+            if user_id not in self._user_vs_identity:
+                self._add_identity(user_id)
+            identity = self._user_vs_identity[user_id]
+
+            embedding = np.array(vector_metadata.embedding, dtype=np.float32)
+            if self._metric in [COSINE_SIMILARITY] and not vector_metadata.normalized:
+                embedding = normalize_vectors(embedding)
+            self._identity_sums[identity] += embedding
+            self._identity_counts[identity] += 1
+            updated_identities.setdefault(identity, []).append(offset + idx)
+
+        if len(updated_identities) == 0:
+            return
+
+        for identity, vector_indices in updated_identities.items():
+            self._identity_vs_vector_indices[identity] = np.concatenate(
+                [
+                    self._identity_vs_vector_indices[identity],
+                    np.array(vector_indices, dtype=np.int64),
+                ]
+            )
+        identities = np.array(sorted(updated_identities), dtype=np.int64)
+        centroids = self._identity_sums[identities] / self._identity_counts[
+            identities, None
+        ].astype(np.float32)
+        if self._metric in [COSINE_SIMILARITY]:
+            centroids = normalize_vectors(centroids)
+        self._identity_faiss.remove_ids(identities)
+        self._identity_faiss.add_with_ids(centroids, identities)
+        logging.info(
+            "Faiss identity index size: {}".format(self._identity_faiss.ntotal)
+        )
+
+    def _add_identity(self, user_id):
+        identity = len(self._identity_vs_vector_indices)
+        capacity = len(self._identity_counts)
+        if identity >= capacity:
+            capacity = max(2 * capacity, 1)
+            sums = np.zeros((capacity, self._identity_faiss.d), dtype=np.float32)
+            sums[:identity] = self._identity_sums[:identity]
+            counts = np.zeros(capacity, dtype=np.int64)
+            counts[:identity] = self._identity_counts[:identity]
+            self._identity_sums, self._identity_counts = sums, counts
+        self._user_vs_identity[user_id] = identity
+        self._identity_vs_vector_indices.append(np.zeros(0, dtype=np.int64))
+
+    def _reconstruct(self, vector_indices: np.ndarray) -> np.ndarray:
+        try:
+            return self._faiss.reconstruct_batch(vector_indices)
+        except RuntimeError as e:
+            raise Exception(
+                f"Identity rerank is not supported by {self._index_type} index: {str(e)}"
+            )
+
+    def _search_result(self, index, distance, with_embedding=True):
+        key = self._vector_index_metadata[index]
+        if not with_embedding:
+            key = replace(key, embedding=None)
+        return FaissSearchResult(
+            key=key,
+            distance=distance,
+            metric_type=self._metric,
+            user_id=self._vector_user_ids[index],
+        )
+
+    def search_identities(
+        self, queries, nearest_neighbours=3, normalized=False, with_embedding=True
+    ):
+        """
+        Two stage search, first shortlists users from identity index of per user
+        centroids, then reranks the faces of shortlisted users with exact distances.
+        Args:
+            queries (list or np.ndarray): query embeddings
+            nearest_neighbours (int): number of faces returned per query
+            normalized (bool): queries are already L2 normalized
+            with_embedding (bool): False leaves the embedding out of result keys
+        Returns:
+            search_result (List[List[FaissSearchResult]]): same layout as search
+        """
+        if self._identity_faiss is None:
+            raise Exception("Make sure identity indexing is enabled")
+        if self._identity_faiss.ntotal == 0:
             return [[None] * nearest_neighbours] * len(queries)
 
         if not isinstance(queries, np.ndarray):
             queries = np.array(queries, dtype=np.float32)
 
-        if self._metric in [COSINE_SIMILARITY]:
+        if queries.shape[0] == 0:
+            return [[None] * nearest_neighbours] * len(queries)
+
+        if self._metric in [COSINE_SIMILARITY] and not normalized:
             queries = normalize_vectors(queries)
 
-        logging.info("queries shape: {}".format(queries.shape))
+        candidates = min(self._identity_candidates, self._identity_faiss.ntotal)
+        _, identities = self._identity_faiss.search(queries, candidates)
+
         search_result = []
-        if queries.shape[0] == 0:
-            return [[None] * nearest_neighbours] * len(queries)
+        for idx in range(len(queries)):
+            vector_indices = np.concatenate(
+                [np.zeros(0, dtype=np.int64)]
+                + [
+                    self._identity_vs_vector_indices[identity]
+                    for identity in identities[idx]
+                    if identity >= 0
+                ]
+            )
 
+            # faces as stored in the face level index, already normalized for cosine
+            embeddings = self._reconstruct(vector_indices)
+            # distances are kept on the same scale as the face level search
+            if self._metric in [COSINE_SIMILARITY]:
+                distances = embeddings @ queries[idx]
+                order = np.argsort(-distances)[:nearest_neighbours]
+            else:
+                difference = embeddings - queries[idx]
+                distances = np.sqrt(np.sum(difference * difference, axis=1))
+                order = np.argsort(distances)[:nearest_neighbours]
+
+            results = [
+                self._search_result(
+                    vector_indices[index], distances[index], with_embedding
+                )
+                for index in order
+            ]
+            results.extend([None] * (nearest_neighbours - len(results)))
+            search_result.append(results)
+        return search_result
+
+    def search_arrays(self, queries, nearest_neighbours=3, normalized=False):
+        """
+        Searches the face level index and returns raw faiss arrays, use lookup to
+        resolve the vector indices to image metadata.
+        Args:
+            queries (list or np.ndarray): query embeddings
+            nearest_neighbours (int): number of neighbours per query
+            normalized (bool): queries are already L2 normalized
+        Returns:
+            distances (np.ndarray): (queries, nearest_neighbours) float32 distances,
+                euclidean (not squared) for euclidean l2
+            indices (np.ndarray): (queries, nearest_neighbours) int64 vector indices,
+                -1 where no neighbour exists
+        """
+        if self._faiss is None:
+            raise Exception("Make sure vectors indexing is enabled")
+
+        if not isinstance(queries, np.ndarray):
+            queries = np.array(queries, dtype=np.float32)
+
+        if self._faiss.ntotal == 0 or queries.shape[0] == 0:
+            return (
+                np.zeros((len(queries), nearest_neighbours), dtype=np.float32),
+                np.full((len(queries), nearest_neighbours), -1, dtype=np.int64),
+            )
+
+        if self._metric in [COSINE_SIMILARITY] and not normalized:
+            queries = normalize_vectors(queries)
+
+        logging.info("queries shape: {}".format(queries.shape))
         distances, indices = self._faiss.search(queries, nearest_neighbours)
-        for idx in range(len(queries)):
+        return self._faiss_distances(distances), indices
+
+    def _faiss_distances(self, distances: np.ndarray) -> np.ndarray:
+        # faiss L2 indices work on squared distances, thresholds are euclidean
+        if self._metric in [COSINE_SIMILARITY]:
+            return distances
+        return np.sqrt(np.maximum(distances, 0))
+
+    def lookup(self, indices: np.ndarray):
+        """
+        Vectorized lookup of faiss vector indices to image hash keys and user ids.
+        Args:
+            indices (np.ndarray): vector indices of any shape, -1 marks a miss
+        Returns:
+            hash_keys (np.ndarray): object array of image hash keys, None for misses
+            user_ids (np.ndarray): object array of user ids, None for misses
+        """
+        indices = np.asarray(indices)
+        return self._vector_hash_keys[indices], self._vector_user_ids[indices]
+
+    def search(
+        self, queries, nearest_neighbours=3, normalized=False, with_embedding=True
+    ):
+        distances, indices = self.search_arrays(
+            queries, nearest_neighbours, normalized=normalized
+        )
+
+        search_result = []
+        for idx in range(len(indices)):
             results = []
             for index, dist in zip(indices[idx], distances[idx]):
-                results.append(
-                    FaissSearchResult(
-                        key=self._vector_index_metadata[index],
-                        distance=dist,
-                        metric_type=self._metric,
-                    )
-                )
+                if index < 0:
+                    results.append(None)
+                    continue
+                results.append(self._search_result(index, dist, with_embedding))
             search_result.append(results)
         return search_result
 
+    def range_search(self, queries, threshold, normalized=False, with_embedding=True):
+        """
+        Returns every indexed face within the threshold of each query using faiss
+        range search, misses are never materialised as FaissSearchResult.
+        Args:
+            queries (list or np.ndarray): query embeddings
+            threshold (float): minimum similarity for cosine similarity, maximum
+                euclidean (not squared) distance for euclidean l2
+            normalized (bool): queries are already L2 normalized
+            with_embedding (bool): False leaves the embedding out of result keys
+        Returns:
+            search_result (List[List[FaissSearchResult]]): hits per query, closest first
+        """
+        if self._faiss is None:
+            raise Exception("Make sure vectors indexing is enabled")
+
+        if not isinstance(queries, np.ndarray):
+            queries = np.array(queries, dtype=np.float32)
+
+        if self._faiss.ntotal == 0 or queries.shape[0] == 0:
+            return [[] for _ in range(len(queries))]
+
+        if self._metric in [COSINE_SIMILARITY] and not normalized:
+            queries = normalize_vectors(queries)
+
+        # faiss L2 range search radius is a squared distance
+        radius = threshold if self._metric in [COSINE_SIMILARITY] else threshold**2
+        try:
+            limits, distances, indices = self._faiss.range_search(
+                queries, float(radius)
+            )
+        except RuntimeError as e:
+            raise Exception(
+                f"Range search is not supported by {self._index_type} index: {str(e)}"
+            )
+
+        distances = self._faiss_distances(distances)
+
+        search_result = []
+        for idx in range(len(queries)):
+            _distances = distances[limits[idx] : limits[idx + 1]]
+            _indices = indices[limits[idx] : limits[idx + 1]]
+            if self._metric in [COSINE_SIMILARITY]:
+                order = np.argsort(-_distances)
+            else:
+                order = np.argsort(_distances)
+            search_result.append(
+                [
+                    self._search_result(
+                        _indices[index], _distances[index], with_embedding
+                    )
+                    for index in order
+                ]
+            )
+        return search_result
+
+    @property
+    def metric(self):
+        return self._metric
+
+    def stats(self) -> dict:
+        return {
+            "ntotal": self._faiss.ntotal if self._faiss is not None else 0,
+            "metadata_count": len(self._image_metadata),
+            "last_dump_seconds": self._last_dump_seconds,
+        }
+
+    def memory_stats(self) -> dict:
+        """
+        Estimated bytes held by the faiss indices and the stored embeddings.
+        """
+        embedding_bytes = 0
+        for metadata in self._image_metadata:
+            for face in metadata.detected_faces:
+                for embedding in face.embeddings.values():
+                    if embedding is not None:
+                        embedding_bytes += _embedding_bytes(embedding)
+        return {
+            "metadata_count": len(self._image_metadata),
+            "vector_count": len(self._vector_index_metadata),
+            "index_bytes": (
+                faiss_index_bytes(self._faiss) if self._faiss is not None else 0
+            ),
+            "identity_index_bytes": (
+                faiss_index_bytes(self._identity_faiss)
+                + self._identity_sums.nbytes
+                + sum(indices.nbytes for indices in self._identity_vs_vector_indices)
+                if self._identity_faiss is not None
+                else 0
+            ),
+            "embedding_bytes": embedding_bytes,
+        }
+
     def get(self, hash_key: str) -> ImageMetadata:
         if hash_key in self._hash_vs_images:
             return self._hash_vs_images[hash_key]
@@ -172,6 +630,7 @@ class ImageMetadataStore:
             ]
             _ = dump_pickle(metadata, self._store_path)
             self._dump_in_progress = False
+            self._last_dump_seconds = (time.time() * 1000 - start_time) / 1000
             logging.info(
                 f"dumping ImageMetadataStore Successfully, time taken: {round(time.time() * 1000 - start_time)} ms"
             )
@@ -0,0 +1,320 @@
+# Standard Imports
+import os
+import zlib
+import logging
+import multiprocessing
+from threading import Lock
+from typing import List, Dict
+
+# Third Party Imports
+import numpy as np
+
+# Internal Imports
+from utils.utils import normalize_vectors
+from constants.constants import COSINE_SIMILARITY
+from stores.image_store import ImageMetadataStore
+from structures.image import ImageMetadata, FaissSearchResult
+
+
+def _shard_worker(connection, image_metadata: List[ImageMetadata], kwargs: dict):
+    """
+    Entry point of a shard process, owns an ImageMetadataStore holding a partition
+    of the users and serves (method, args, kwargs) calls received over the pipe.
+    """
+    try:
+        store = ImageMetadataStore(image_metadata, **kwargs)
+        del image_metadata
+        connection.send((True, None))
+    except Exception as e:
+        connection.send((False, f"Error in building shard: {str(e)}"))
+        return
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        method, args, kw = message
+        try:
+            connection.send((True, getattr(store, method)(*args, **kw)))
+        except Exception as e:
+            connection.send((False, str(e)))
+    connection.close()
+
+
+class ShardedImageMetadataStore:
+    """
+    Partitions users across local worker processes, each owning its own
+    ImageMetadataStore shard, and scatters searches to all shards concurrently
+    before merging the top-k. Exposes the same interface as ImageMetadataStore.
+    Vector indices returned by search_arrays are global, encoded as
+    local_index * num_shards + shard.
+    """
+
+    def __init__(self, image_metadata: List[ImageMetadata], **kwargs):
+        _sharding_kwargs = kwargs.get("sharding_kwargs", {})
+        self._num_shards = _sharding_kwargs.get("num_shards", 2)
+        start_method = _sharding_kwargs.get("start_method", "spawn")
+
+        self.vector_indexing = kwargs.get("vector_indexing", False)
+        self.identity_indexing = self.vector_indexing and kwargs.get(
+            "identity_indexing", False
+        )
+        self._metric = kwargs.get("indexing_kwargs", {}).get(
+            "metric", COSINE_SIMILARITY
+        )
+
+        partitions = [[] for _ in range(self._num_shards)]
+        self._hash_vs_shard = {}
+        for metadata in image_metadata:
+            shard = self._shard_of(metadata.user_id)
+            partitions[shard].append(metadata)
+            self._hash_vs_shard[metadata.hash_key] = shard
+
+        store_path = kwargs.get("store_path", None)
+        context = multiprocessing.get_context(start_method)
+        self._lock = Lock()
+        # set when a shard pipe fails, its requests and responses are out of step
+        self._broken = None
+        self._connections, self._processes = [], []
+        for shard in range(self._num_shards):
+            shard_kwargs = {
+                key: value
+                for key, value in kwargs.items()
+                if key not in ["sharding_kwargs", "rebuild"]
+            }
+            if store_path:
+                root, ext = os.path.splitext(store_path)
+                shard_kwargs["store_path"] = f"{root}_shard_{shard}{ext}"
+
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_shard_worker,
+                args=(child_connection, partitions[shard], shard_kwargs),
+                daemon=True,
+            )
+            process.start()
+            child_connection.close()
+            self._connections.append(parent_connection)
+            self._processes.append(process)
+        del partitions
+
+        for shard, connection in enumerate(self._connections):
+            success, error = connection.recv()
+            if not success:
+                self.close()
+                raise Exception(f"Error in shard {shard}: {error}")
+        logging.info(f"{self._num_shards} image store shards started successfully")
+
+    def _shard_of(self, user_id):
+        return zlib.crc32(str(user_id).encode("utf-8")) % self._num_shards
+
+    def _scatter(self, calls: Dict[int, tuple]) -> dict:
+        # all requests are sent before any response is read, so shards search
+        # concurrently. Every response is read before raising, a response left in
+        # a pipe would be returned to the next call of that shard instead.
+        with self._lock:
+            if self._broken is not None:
+                raise Exception(f"Image store shards are unusable: {self._broken}")
+
+            sent, errors = [], []
+            for shard, (method, args, kw) in calls.items():
+                try:
+                    self._connections[shard].send((method, args, kw))
+                except OSError as e:
+                    self._broken = f"shard {shard} pipe failed: {str(e)}"
+                    errors.append(f"Error in sending to shard {shard}: {str(e)}")
+                    break
+                except Exception as e:
+                    # pickling fails before anything is written to the pipe
+                    errors.append(f"Error in sending to shard {shard}: {str(e)}")
+                    break
+                sent.append(shard)
+
+            responses = {}
+            for shard in sent:
+                try:
+                    success, response = self._connections[shard].recv()
+                except Exception as e:
+                    self._broken = f"shard {shard} pipe failed: {str(e)}"
+                    errors.append(f"Error in shard {shard}: {str(e)}")
+                    continue
+                if success:
+                    responses[shard] = response
+                else:
+                    errors.append(f"Error in shard {shard}: {response}")
+
+            if errors:
+                raise Exception("; ".join(errors))
+        return responses
+
+    def _broadcast(self, method, *args, **kw) -> list:
+        responses = self._scatter(
+            {shard: (method, args, kw) for shard in range(self._num_shards)}
+        )
+        return [responses[shard] for shard in range(self._num_shards)]
+
+    def _prepare_queries(self, queries, normalized):
+        if not isinstance(queries, np.ndarray):
+            queries = np.array(queries, dtype=np.float32)
+        # normalize once in the router instead of once per shard
+        if self._metric in [COSINE_SIMILARITY] and not normalized and len(queries) > 0:
+            queries = normalize_vectors(queries)
+        return queries
+
+    def _merge_search_results(self, shard_results, nearest_neighbours=None):
+        merged = []
+        for per_query in zip(*shard_results):
+            hits = [result for results in per_query for result in results if result]
+            hits.sort(
+                key=lambda result: result.distance,
+                reverse=self._metric in [COSINE_SIMILARITY],
+            )
+            if nearest_neighbours is not None:
+                hits = hits[:nearest_neighbours]
+                hits.extend([None] * (nearest_neighbours - len(hits)))
+            merged.append(hits)
+        return merged
+
+    def add(self, image_metadata: ImageMetadata):
+        if image_metadata.hash_key in self._hash_vs_shard:
+            metadata = self.get(image_metadata.hash_key)
+            return False, f"Duplicate image. image {metadata.image_path} already exists"
+
+        shard = self._shard_of(image_metadata.user_id)
+        is_add, errors = self._scatter({shard: ("add", (image_metadata,), {})})[shard]
+        if is_add:
+            self._hash_vs_shard[image_metadata.hash_key] = shard
+        return is_add, errors
+
+    def search_arrays(self, queries, nearest_neighbours=3, normalized=False):
+        queries = self._prepare_queries(queries, normalized)
+        shard_results = self._broadcast(
+            "search_arrays", queries, nearest_neighbours, normalized=True
+        )
+
+        distances = np.concatenate([result[0] for result in shard_results], axis=1)
+        indices = np.concatenate(
+            [
+                np.where(result[1] >= 0, result[1] * self._num_shards + shard, -1)
+                for shard, result in enumerate(shard_results)
+            ],
+            axis=1,
+        )
+        # misses are pushed behind every hit before taking the top-k
+        if self._metric in [COSINE_SIMILARITY]:
+            sort_keys = np.where(indices >= 0, -distances, np.inf)
+        else:
+            sort_keys = np.where(indices >= 0, distances, np.inf)
+        order = np.argsort(sort_keys, axis=1, kind="stable")[:, :nearest_neighbours]
+        return (
+            np.take_along_axis(distances, order, axis=1),
+            np.take_along_axis(indices, order, axis=1),
+        )
+
+    def lookup(self, indices: np.ndarray):
+        indices = np.asarray(indices)
+        hash_keys = np.full(indices.shape, None, dtype=object)
+        user_ids = np.full(indices.shape, None, dtype=object)
+
+        valid = indices >= 0
+        shards, local_indices = indices % self._num_shards, indices // self._num_shards
+        masks = {
+            int(shard): valid & (shards == shard) for shard in np.unique(shards[valid])
+        }
+        responses = self._scatter(
+            {
+                shard: ("lookup", (local_indices[mask],), {})
+                for shard, mask in masks.items()
+            }
+        )
+        for shard, mask in masks.items():
+            hash_keys[mask], user_ids[mask] = responses[shard]
+        return hash_keys, user_ids
+
+    def search(
+        self, queries, nearest_neighbours=3, normalized=False, with_embedding=True
+    ):
+        queries = self._prepare_queries(queries, normalized)
+        shard_results = self._broadcast(
+            "search",
+            queries,
+            nearest_neighbours,
+            normalized=True,
+            with_embedding=with_embedding,
+        )
+        return self._merge_search_results(shard_results, nearest_neighbours)
+
+    def search_identities(
+        self, queries, nearest_neighbours=3, normalized=False, with_embedding=True
+    ):
+        queries = self._prepare_queries(queries, normalized)
+        shard_results = self._broadcast(
+            "search_identities",
+            queries,
+            nearest_neighbours,
+            normalized=True,
+            with_embedding=with_embedding,
+        )
+        return self._merge_search_results(shard_results, nearest_neighbours)
+
+    def range_search(self, queries, threshold, normalized=False, with_embedding=True):
+        queries = self._prepare_queries(queries, normalized)
+        shard_results = self._broadcast(
+            "range_search",
+            queries,
+            threshold,
+            normalized=True,
+            with_embedding=with_embedding,
+        )
+        return self._merge_search_results(shard_results)
+
+    def train(self, vectors=None, normalized=False):
+        # every shard trains its own index on the same training set
+        if vectors is not None:
+            vectors = self._prepare_queries(vectors, normalized)
+        self._broadcast("train", vectors, normalized=True)
+
+    @property
+    def metric(self):
+        return self._metric
+
+    def stats(self) -> dict:
+        # counts add up across shards, durations report the slowest shard
+        stats = {}
+        for shard_stats in self._broadcast("stats"):
+            for key, value in shard_stats.items():
+                if key.endswith("_seconds"):
+                    stats[key] = max(stats.get(key, 0), value)
+                else:
+                    stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def memory_stats(self) -> dict:
+        # bytes are held by the shard processes, reported per shard and in total
+        shard_stats = self._broadcast("memory_stats")
+        stats = {
+            key: sum(stats[key] for stats in shard_stats) for key in shard_stats[0]
+        }
+        stats["shards"] = shard_stats
+        return stats
+
+    def get(self, hash_key: str) -> ImageMetadata:
+        if hash_key not in self._hash_vs_shard:
+            raise KeyError(
+                f"hash key {hash_key} not found in ShardedImageMetadataStore"
+            )
+        shard = self._hash_vs_shard[hash_key]
+        return self._scatter({shard: ("get", (hash_key,), {})})[shard]
+
+    def close(self):
+        for connection in self._connections:
+            try:
+                connection.send(None)
+                connection.close()
+            except (OSError, BrokenPipeError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
@@ -5,7 +5,7 @@ import logging
 # Third Party Imports
 
 # Internal Imports
-from stores.builder import ImageMetadataStoreBuilder
+from stores.builder import ImageMetadataStoreBuilder, ShardedImageMetadataStoreBuilder
 
 
 class StoreHolder(object):
@@ -21,7 +21,11 @@ class StoreHolder(object):
 
             logging.info("kwargs: {}".format(kwargs))
             builder = globals()[builder_name](store_path, **kwargs)
+            previous_store = StoreHolder._store_holder.get(store_name, None)
             StoreHolder._store_holder[store_name] = builder.load(store_path, **kwargs)
+            # sharded stores own worker processes which have to be stopped
+            if hasattr(previous_store, "close"):
+                previous_store.close()
             StoreHolder._last_load_time[store_name] = time.time()
 
         return StoreHolder._store_holder[store_name]
@@ -29,3 +33,7 @@ class StoreHolder(object):
     @staticmethod
     def get_store(store_name):
         return StoreHolder._store_holder.get(store_name, None)
+
+    @staticmethod
+    def get_stores():
+        return dict(StoreHolder._store_holder)
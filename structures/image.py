@@ -8,6 +8,7 @@ import numpy as np
 
 # Internal Imports
 from utils.image_utils import image_hash
+from constants.constants import EYES_ALIGNMENT
 
 
 @dataclass
@@ -19,6 +20,8 @@ class FaceSegment:
     left_eye: tuple = None
     right_eye: tuple = None
     confidence: float = 0
+    # five [x, y] points: eyes, nose and mouth corners in detector order
+    landmarks: list = None
 
     def to_json(self):
         return {
@@ -29,8 +32,38 @@ class FaceSegment:
             "left_eye": self.left_eye,
             "right_eye": self.right_eye,
             "confidence": self.confidence,
+            "landmarks": self.landmarks,
         }
 
+    def scale(self, factor: float) -> "FaceSegment":
+        """
+        Segment in an image resized by factor, e.g. from a draft decoded image back
+        to full resolution.
+        """
+        if factor == 1:
+            return self
+
+        def pixel(value):
+            return int(round(value))
+
+        def point(value, cast=float):
+            return None if value is None else tuple(cast(v * factor) for v in value)
+
+        return FaceSegment(
+            x=pixel(self.x * factor),
+            y=pixel(self.y * factor),
+            w=pixel(self.w * factor),
+            h=pixel(self.h * factor),
+            left_eye=point(self.left_eye, pixel),
+            right_eye=point(self.right_eye, pixel),
+            confidence=self.confidence,
+            landmarks=(
+                None
+                if self.landmarks is None
+                else [list(point(landmark)) for landmark in self.landmarks]
+            ),
+        )
+
     @staticmethod
     def from_json(json_dict):
         return FaceSegment(
@@ -41,6 +74,7 @@ class FaceSegment:
             left_eye=json_dict["left_eye"],
             right_eye=json_dict["right_eye"],
             confidence=json_dict["confidence"],
+            landmarks=json_dict.get("landmarks", None),
         )
 
 
@@ -51,7 +85,10 @@ class DetectedFace:
     image: np.ndarray = None
     alignment: bool = False
     expand_percentage: float = 0
+    # alignment mode the face was cropped with, embeddings depend on it
+    alignment_mode: str = EYES_ALIGNMENT
     embeddings: Dict[str, np.ndarray] = field(default_factory=dict)
+    normalized: Dict[str, bool] = field(default_factory=dict)
 
     def __str__(self):
         return f"{self.model_name}_{self.alignment}_{self.expand_percentage}"
@@ -59,19 +96,27 @@ class DetectedFace:
     def get_embedding(self, model_name):
         return self.embeddings.get(model_name, None)
 
-    def add_embedding(self, model_name: str, embedding: np.ndarray):
+    def is_normalized(self, model_name):
+        return self.normalized.get(model_name, False)
+
+    def add_embedding(
+        self, model_name: str, embedding: np.ndarray, normalized: bool = False
+    ):
         self.embeddings[model_name] = embedding
+        self.normalized[model_name] = normalized
 
     def to_json(self):
         return {
             "model_name": self.model_name,
             "face_segments": self.facial_segments.to_json(),
             "alignment": self.alignment,
+            "alignment_mode": self.alignment_mode,
             "expand_percentage": self.expand_percentage,
             "embeddings": {
                 model_name: embedding.tolist()
                 for model_name, embedding in self.embeddings.items()
             },
+            "normalized": self.normalized,
         }
 
     @staticmethod
@@ -80,11 +125,13 @@ class DetectedFace:
             model_name=json_dict["model_name"],
             facial_segments=FaceSegment.from_json(json_dict["face_segments"]),
             alignment=json_dict["alignment"],
+            alignment_mode=json_dict.get("alignment_mode", EYES_ALIGNMENT),
             expand_percentage=json_dict["expand_percentage"],
             embeddings={
                 model_name: np.array(embedding)
                 for model_name, embedding in json_dict["embeddings"].items()
             },
+            normalized=json_dict.get("normalized", {}),
         )
 
 
@@ -155,6 +202,7 @@ class ImageVectorMetadata:
     image_hash_key: str
     embedding_model: str
     embedding: np.ndarray
+    normalized: bool = False
 
     def __str__(self):
         return f"{self.image_hash_key}_{self.index}_{self.embedding_model}"
@@ -165,3 +213,4 @@ class FaissSearchResult:
     key: Any
     metric_type: str
     distance: float = 0.0
+    user_id: Any = None
@@ -0,0 +1,105 @@
+# Third Party Imports
+import numpy as np
+import pytest
+
+# Internal Imports
+import components.verification as verification
+from stores.image_store import ImageMetadataStore
+from structures.image import ImageMetadata, DetectedFace, FaceSegment
+from constants.constants import (
+    COSINE_SIMILARITY,
+    EUCLIDEAN_L2,
+    NEAREST_SEARCH,
+    RANGE_SEARCH,
+    VERIFICATION_THRESHOLDS,
+)
+
+EMBEDDING_NAME = "FaceNet512"
+
+
+def _face(embedding):
+    face = DetectedFace("FastMtcnn", FaceSegment(0, 0, 1, 1))
+    face.add_embedding(EMBEDDING_NAME, np.asarray(embedding, dtype=np.float32))
+    return face
+
+
+def _at_distance(origin, distance, metric, rng):
+    """
+    Point at the given euclidean distance, or cosine similarity, from origin.
+    """
+    direction = rng.standard_normal(origin.shape).astype(np.float32)
+    direction -= direction @ origin / (origin @ origin) * origin
+    direction /= np.linalg.norm(direction)
+    if metric == COSINE_SIMILARITY:
+        unit = origin / np.linalg.norm(origin)
+        return distance * unit + np.sqrt(1 - distance**2) * direction
+    return origin + distance * direction
+
+
+def _store(metric, gallery):
+    image_metadata = [
+        ImageMetadata(
+            f"/gallery/{idx}.jpg",
+            f"user-{idx}",
+            hash_key=f"hash-{idx}",
+            detected_faces=[_face(embedding)],
+        )
+        for idx, embedding in enumerate(gallery)
+    ]
+    return ImageMetadataStore(
+        image_metadata,
+        vector_indexing=True,
+        indexing_kwargs={"metric": metric, "embedding_model": EMBEDDING_NAME},
+    )
+
+
+@pytest.mark.parametrize("metric", [COSINE_SIMILARITY, EUCLIDEAN_L2])
+def test_range_mode_matches_nearest_recognition(metric, monkeypatch):
+    rng = np.random.default_rng(0)
+    threshold = VERIFICATION_THRESHOLDS[EMBEDDING_NAME][metric]
+    scale = 1.0 if metric == COSINE_SIMILARITY else 100.0
+    gallery = rng.standard_normal((8, 512)).astype(np.float32) * scale
+    store = _store(metric, gallery)
+
+    if metric == COSINE_SIMILARITY:
+        offsets = [0.95, 0.8, 0.72, 0.5]
+    else:
+        # 11.3 is a squared distance of about 128, far above the threshold
+        offsets = [1.0, 11.3, 23.0, 40.0]
+    queries = [
+        _at_distance(gallery[idx], offset, metric, rng)
+        for idx, offset in enumerate(offsets)
+    ]
+
+    monkeypatch.setattr(
+        verification.StoreHolder, "get_store", staticmethod(lambda name: store)
+    )
+    monkeypatch.setattr(
+        verification,
+        "represent",
+        lambda images, **kwargs: [[_face(image)] for image in images],
+    )
+
+    nearest = verification.recognize(
+        queries, EMBEDDING_NAME, "store", search_mode=NEAREST_SEARCH
+    )
+    ranged = verification.recognize(
+        queries, EMBEDDING_NAME, "store", search_mode=RANGE_SEARCH
+    )
+
+    for idx, offset in enumerate(offsets):
+        expected = (
+            offset >= threshold if metric == COSINE_SIMILARITY else offset < threshold
+        )
+        assert nearest[idx]["verified"] == expected
+        assert nearest[idx]["distance"] == pytest.approx(offset, abs=0.01)
+        assert ranged[idx]["verified"] == expected
+        assert ranged[idx]["userId"] == nearest[idx]["userId"]
+        matches = ranged[idx]["matches"]
+        if expected:
+            assert matches[0] == {
+                "userId": f"user-{idx}",
+                "distance": nearest[idx]["distance"],
+            }
+        else:
+            assert all(match["userId"] != f"user-{idx}" for match in matches)
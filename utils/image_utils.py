@@ -4,7 +4,9 @@ import io
 import base64
 import hashlib
 import logging
-from typing import Union
+import contextvars
+from typing import Union, List, Tuple, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Third Party Imports
 import cv2
@@ -14,18 +16,28 @@ from PIL import ImageOps
 from tensorflow.keras.preprocessing import image as tf_image
 
 # Internal Imports
+from utils.tracing import span
+from configurations.config import app_config
+from utils.utils import file_digest
+from constants.constants import FIVE_POINT_TEMPLATE
 
+# formats stored as received by export_image_using_pil, found by the store builder
+EXPORT_EXTENSIONS = {"JPEG": ".jpeg", "PNG": ".png"}
 
-def load_image_using_pil(image: Union[str, np.ndarray]) -> np.ndarray:
-    if isinstance(image, str):
-        if os.path.isfile(image):
-            # reading an image
-            image = pilImage.open(image)
-        else:
-            # base64 encoded image
-            image_string = base64.b64decode(image)
-            image = pilImage.open(io.BytesIO(image_string))
-        # convert image to numpy array for further processing
+
+def _open_image(image: str) -> pilImage.Image:
+    if os.path.isfile(image):
+        # reading an image
+        return pilImage.open(image)
+    # base64 encoded image
+    with span("base64_decode"):
+        image_string = base64.b64decode(image)
+    return pilImage.open(io.BytesIO(image_string))
+
+
+def _to_array(image: pilImage.Image) -> np.ndarray:
+    # convert image to numpy array for further processing
+    with span("image_decode"):
         if image.mode in ("RGBA", "LA") or (
             image.mode == "P" and "transparency" in image.info
         ):
@@ -34,24 +46,151 @@ def load_image_using_pil(image: Union[str, np.ndarray]) -> np.ndarray:
         image = ImageOps.exif_transpose(
             image
         )  # helps in keeping the orientation of the image intact
-        image = np.array(image)
-        return image
+        return np.array(image)
+
+
+def load_image_using_pil(image: Union[str, np.ndarray]) -> np.ndarray:
+    if isinstance(image, str):
+        return _to_array(_open_image(image))
     elif isinstance(image, np.ndarray):
         return image
     return image
 
 
+def load_reduced_image(
+    image: Union[str, np.ndarray], max_side: int = None
+) -> Tuple[np.ndarray, float]:
+    """
+    Decodes a JPEG with PIL draft mode, the DCT is scaled by 1/2, 1/4 or 1/8 so the
+    longer side stays at least max_side, which skips most of the decoding work of
+    large photos. Returns the image and the factor mapping its coordinates back to
+    full resolution, other formats and arrays are returned as is with factor 1.
+    """
+    if not isinstance(image, str) or not max_side:
+        return load_image_using_pil(image), 1.0
+
+    image = _open_image(image)
+    scale = 1.0
+    width, height = image.size
+    if image.format == "JPEG" and max(width, height) > max_side:
+        ratio = max_side / max(width, height)
+        box = image.draft(
+            image.mode,
+            (max(1, int(np.ceil(width * ratio))), max(1, int(np.ceil(height * ratio)))),
+        )
+        if box is not None:
+            scale = width / box[1][2]
+    return _to_array(image), scale
+
+
+_decode_executor = None
+
+
+def _load_image_or_none(image, max_side=None):
+    try:
+        return load_reduced_image(image, max_side)
+    except Exception as e:
+        logging.error(f"Error in decoding image: {str(e)}")
+        return None, 1.0
+
+
+def iter_decoded(
+    images: List[Union[str, np.ndarray]], max_side: int = None
+) -> Iterator[Tuple[int, Union[np.ndarray, None], float]]:
+    """
+    Yields (index, image, full resolution factor) of every image as soon as it is
+    decoded, in completion order, so a consumer can work on the first decoded
+    images while the others are still decoding. Arrays come first, paths and
+    base64 strings are decoded on the shared thread pool, see load_reduced_image.
+    """
+    global _decode_executor
+    encoded = [idx for idx, image in enumerate(images) if isinstance(image, str)]
+    if len(encoded) <= 1 or app_config.decoding.workers <= 1:
+        for idx, image in enumerate(images):
+            yield (idx, *_load_image_or_none(image, max_side))
+        return
+
+    if _decode_executor is None:
+        _decode_executor = ThreadPoolExecutor(
+            max_workers=app_config.decoding.workers, thread_name_prefix="image-decode"
+        )
+    futures = {
+        _decode_executor.submit(
+            contextvars.copy_context().run, _load_image_or_none, images[idx], max_side
+        ): idx
+        for idx in encoded
+    }
+    for idx, image in enumerate(images):
+        if not isinstance(image, str):
+            yield idx, image, 1.0
+    for future in as_completed(futures):
+        yield (futures[future], *future.result())
+
+
+def _decode_all(images, max_side=None) -> List[Tuple[Union[np.ndarray, None], float]]:
+    decoded = [None] * len(images)
+    for idx, image, scale in iter_decoded(images, max_side):
+        decoded[idx] = (image, scale)
+    return decoded
+
+
+def load_images(images: List[Union[str, np.ndarray]]) -> List[Union[np.ndarray, None]]:
+    """
+    Decodes paths and base64 strings on a shared thread pool (PIL releases the GIL
+    while decoding), results keep the order of images. An image failing to decode
+    is logged and returned as None instead of failing the whole batch. Every task
+    runs in a copy of the caller's context, so decode spans land in the request trace.
+    """
+    return [image for image, _ in _decode_all(images)]
+
+
+def load_reduced_images(
+    images: List[Union[str, np.ndarray]], max_side: int = None
+) -> Tuple[List[Union[np.ndarray, None]], List[float]]:
+    """
+    load_images with JPEGs decoded in draft mode down to max_side, see
+    load_reduced_image. Returns the images and their full resolution factors.
+    """
+    decoded = _decode_all(images, max_side)
+    return [image for image, _ in decoded], [scale for _, scale in decoded]
+
+
 def export_image_using_pil(image: Union[str, np.ndarray], path: str):
+    """
+    Saves image to path and returns the saved path. Base64 JPEG and PNG images are
+    written as received, with the extension of their format, so the stored file
+    has the content hash of the request and keeps its EXIF orientation.
+    """
     if isinstance(image, np.ndarray):
         image = pilImage.fromarray(image)
     else:
         # base64 encoded image
         image_string = base64.b64decode(image)
         image = pilImage.open(io.BytesIO(image_string))
+        if image.format in EXPORT_EXTENSIONS:
+            path = os.path.splitext(path)[0] + EXPORT_EXTENSIONS[image.format]
+            with open(path, "wb") as file:
+                file.write(image_string)
+            return path
     image.save(path)
     return path
 
 
+def content_hash(image: Union[str, np.ndarray]) -> str:
+    """
+    SHA-256 of the encoded bytes of a path or base64 image, which keys an image
+    without decoding it, or of the shape, dtype and pixels of an array.
+    """
+    if isinstance(image, np.ndarray):
+        digest = hashlib.sha256()
+        digest.update(f"{image.shape}|{image.dtype}".encode("utf-8"))
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+    if os.path.isfile(image):
+        return file_digest(image)
+    return hashlib.sha256(base64.b64decode(image)).hexdigest()
+
+
 def image_hash(image_path):
     with pilImage.open(image_path) as img:
         img_byte_arr = io.BytesIO()
@@ -104,6 +243,126 @@ def align_face(img, left_eye, right_eye):
     return img, angle
 
 
+def align_facial_area(img, facial_area, left_eye, right_eye):
+    """
+    Aligned crop of a facial area, equivalent to rotating the whole image with
+    align_face and cropping the rotated facial area, but a single warpAffine
+    computes only the output pixels instead of rotating the full frame per face.
+    Args:
+        img (np.ndarray): pre-loaded image with detected face
+        facial_area (tuple): (x1, y1, x2, y2) of the face in img
+        left_eye (list or tuple): coordinates of left eye with respect to the person itself
+        right_eye(list or tuple): coordinates of right eye with respect to the person itself
+    Returns:
+        img (np.ndarray): aligned facial image
+    """
+    x1, y1, x2, y2 = facial_area
+    if left_eye is None or right_eye is None or img.shape[0] == 0 or img.shape[1] == 0:
+        return img[int(y1) : int(y2), int(x1) : int(x2)]
+
+    angle = float(
+        np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0]))
+    )
+    height, width = img.shape[0], img.shape[1]
+    rotated_x1, rotated_y1, rotated_x2, rotated_y2 = (
+        int(value)
+        for value in rotate_facial_area(
+            facial_area=facial_area, angle=angle, size=(height, width)
+        )
+    )
+    if rotated_x2 <= rotated_x1 or rotated_y2 <= rotated_y1:
+        return img[0:0, 0:0]
+
+    # same rotation as PIL's Image.rotate around the image center (pixel centers
+    # at integer coordinates), shifted so the rotated facial area starts at (0, 0)
+    matrix = cv2.getRotationMatrix2D(((width - 1) / 2, (height - 1) / 2), angle, 1.0)
+    matrix[0, 2] -= rotated_x1
+    matrix[1, 2] -= rotated_y1
+    return cv2.warpAffine(
+        img,
+        matrix,
+        (rotated_x2 - rotated_x1, rotated_y2 - rotated_y1),
+        flags=cv2.INTER_NEAREST,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=0,
+    )
+
+
+def similarity_transform(source, target) -> np.ndarray:
+    """
+    Least squares similarity transform (rotation, uniform scale, translation)
+    mapping every source point onto its target point (Umeyama, 1991).
+    Args:
+        source (np.ndarray): (N, 2) points
+        target (np.ndarray): (N, 2) points
+    Returns:
+        matrix (np.ndarray): 2 x 3 float64 affine matrix, None for degenerate points
+    """
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    source_mean, target_mean = source.mean(axis=0), target.mean(axis=0)
+    source_centered, target_centered = source - source_mean, target - target_mean
+    source_variance = np.mean(np.sum(source_centered**2, axis=1))
+    if source_variance <= 1e-12:
+        return None
+
+    covariance = target_centered.T @ source_centered / len(source)
+    u, d, vt = np.linalg.svd(covariance)
+    # keeps the rotation proper, reflections never map a face onto the template
+    signs = np.array([1.0, np.sign(np.linalg.det(u) * np.linalg.det(vt)) or 1.0])
+    rotation = u @ np.diag(signs) @ vt
+    scale = np.sum(d * signs) / source_variance
+    translation = target_mean - scale * rotation @ source_mean
+    return np.hstack([scale * rotation, translation[:, None]])
+
+
+def align_five_points(img, landmarks, output_size=160):
+    """
+    Warps the face straight to an output_size x output_size float32 chip scaled to
+    [0, 1], with the least squares similarity transform of all five detected
+    landmarks onto FIVE_POINT_TEMPLATE. Only the source area covered by the chip
+    is converted to float32, so the chip needs no further /255 copy.
+    Args:
+        img (np.ndarray): pre-loaded uint8 image with detected face
+        landmarks (list): five [x, y] points, eyes, nose and mouth corners
+        output_size (int): side of the returned chip
+    Returns:
+        img (np.ndarray): aligned output_size x output_size float32 chip, None when
+            no transform could be estimated
+    """
+    source = np.asarray(landmarks, dtype=np.float64).reshape(5, 2)
+    template = np.asarray(FIVE_POINT_TEMPLATE, dtype=np.float64) * (output_size / 112)
+    matrix = similarity_transform(source, template)
+    if matrix is None:
+        return None
+
+    # source bounding box of the chip corners, one pixel wider for interpolation
+    corners = np.array(
+        [[0, 0], [output_size, 0], [0, output_size], [output_size, output_size]],
+        dtype=np.float64,
+    )
+    inverse = cv2.invertAffineTransform(matrix)
+    mapped = corners @ inverse[:, :2].T + inverse[:, 2]
+    x1, y1 = np.maximum(np.floor(mapped.min(axis=0)).astype(int) - 1, 0)
+    x2 = min(int(np.ceil(mapped[:, 0].max())) + 2, img.shape[1])
+    y2 = min(int(np.ceil(mapped[:, 1].max())) + 2, img.shape[0])
+    channels = img.shape[2:]
+    if x2 <= x1 or y2 <= y1:
+        return np.zeros((output_size, output_size, *channels), dtype=np.float32)
+
+    area = img[y1:y2, x1:x2].astype(np.float32)
+    area *= 1 / 255 if img.dtype == np.uint8 else 1.0
+    matrix[:, 2] += matrix[:, :2] @ np.array([x1, y1], dtype=np.float64)
+    return cv2.warpAffine(
+        area,
+        matrix,
+        (output_size, output_size),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=0,
+    )
+
+
 def rotate_facial_area(facial_area, angle, size):
     """
     Rotate the facial area around its center.
@@ -162,6 +421,41 @@ def rotate_facial_area(facial_area, angle, size):
     return x1, y1, x2, y2
 
 
+def letterbox_into(img, out, reverse_channels=False):
+    """
+    Resizes img keeping its aspect ratio into the center of out, the same geometry
+    as resize_image, without intermediate float copies: the uint8 image is resized
+    as is and scaled to [0, 1] while being written into out.
+    Args:
+        img (np.ndarray): uint8 image, or float image in [0, 1]
+        out (np.ndarray): zero filled float32 (height, width, channels) target, e.g.
+            one slot of a preallocated batch
+        reverse_channels (bool): write channels in reverse order (RGB to BGR)
+    Returns:
+        out (np.ndarray): the filled target
+    """
+    target_height, target_width = out.shape[0], out.shape[1]
+    factor = min(target_height / img.shape[0], target_width / img.shape[1])
+    dsize = (int(img.shape[1] * factor), int(img.shape[0] * factor))
+    if dsize[0] == 0 or dsize[1] == 0:
+        return out
+    if dsize != (img.shape[1], img.shape[0]):
+        img = cv2.resize(img, dsize)
+
+    top = (target_height - dsize[1]) // 2
+    left = (target_width - dsize[0]) // 2
+    if reverse_channels:
+        img = img[:, :, ::-1]
+    scale = 1 / 255 if img.dtype == np.uint8 or img.max() > 1 else 1.0
+    np.multiply(
+        img,
+        scale,
+        out=out[top : top + dsize[1], left : left + dsize[0]],
+        casting="unsafe",
+    )
+    return out
+
+
 def resize_image(img, target_size):
     """
     Resize an image to expected size of a ml model with adding black pixels.
@@ -0,0 +1,194 @@
+# Standard Imports
+import bisect
+from threading import Lock
+from contextvars import ContextVar
+from typing import Tuple, List
+
+# Third Party Imports
+
+# Internal Imports
+
+# endpoint of the request being served, used to label stage level metrics
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="internal")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=None) -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            lines.extend(self._render_value(label_values, value))
+        return lines
+
+    def _render_value(self, label_values, value) -> List[str]:
+        labels = _format_labels(self.label_names, label_values)
+        return [f"{self.name}{labels} {float(value)}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # per bucket (non cumulative) counts, the last slot is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state = self._values[key]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, label_values, value) -> List[str]:
+        counts, total, count = value
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            labels = _format_labels(self.label_names, label_values, f'le="{le}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, label_values)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise Exception(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_LATENCY = REGISTRY.register(
+    Histogram(
+        "facetrace_stage_latency_seconds",
+        "Latency of pipeline stages wrapped by timeit",
+        ("stage", "endpoint", "model"),
+    )
+)
+STAGE_BATCH_SIZE = REGISTRY.register(
+    Histogram(
+        "facetrace_stage_batch_size",
+        "Number of inputs passed to pipeline stages",
+        ("stage", "endpoint", "model"),
+        buckets=BATCH_SIZE_BUCKETS,
+    )
+)
+STAGE_ERRORS = REGISTRY.register(
+    Counter(
+        "facetrace_stage_errors_total",
+        "Pipeline stage calls which raised an exception",
+        ("stage", "endpoint", "model"),
+    )
+)
+HTTP_REQUESTS = REGISTRY.register(
+    Counter(
+        "facetrace_http_requests_total",
+        "HTTP requests served",
+        ("endpoint", "status"),
+    )
+)
+HTTP_LATENCY = REGISTRY.register(
+    Histogram(
+        "facetrace_http_request_latency_seconds",
+        "HTTP request latency",
+        ("endpoint",),
+    )
+)
+STORE_NTOTAL = REGISTRY.register(
+    Gauge("facetrace_faiss_ntotal", "Vectors in the faiss index", ("store",))
+)
+STORE_METADATA_COUNT = REGISTRY.register(
+    Gauge("facetrace_store_metadata_count", "Images held by the store", ("store",))
+)
+STORE_DUMP_DURATION = REGISTRY.register(
+    Gauge(
+        "facetrace_store_dump_duration_seconds",
+        "Duration of the last store dump",
+        ("store",),
+    )
+)
+CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "facetrace_cache_requests_total",
+        "Result cache lookups by outcome",
+        ("cache", "result"),
+    )
+)
+CACHE_BYTES = REGISTRY.register(
+    Gauge("facetrace_cache_bytes", "Estimated bytes held by the cache", ("cache",))
+)
+CACHE_ENTRIES = REGISTRY.register(
+    Gauge("facetrace_cache_entries", "Entries held by the cache", ("cache",))
+)
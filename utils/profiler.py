@@ -0,0 +1,148 @@
+# Standard Imports
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Tuple
+
+# Third Party Imports
+
+# Internal Imports
+
+MAX_PROFILE_SECONDS = 120
+# shorter intervals busy spin the sampler, holding the GIL of the profiled service
+MIN_PROFILE_INTERVAL = 0.001
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+# only one profile runs at a time, concurrent samplers would skew each other
+_profile_lock = threading.Lock()
+
+
+def _frame_key(frame) -> Tuple[str, str, int]:
+    code = frame.f_code
+    return code.co_name, code.co_filename, code.co_firstlineno
+
+
+def _frame_label(frame_key) -> str:
+    name, filename, line = frame_key
+    # ';' separates frames in the collapsed format
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ":")
+
+
+class Profile:
+    """
+    Stack samples aggregated per (thread name, stack), stacks are root first.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.duration = 0.0
+        self.sample_count = 0
+        self.stacks = Counter()
+
+    def to_collapsed(self) -> str:
+        """
+        Brendan Gregg's collapsed stack format, one "thread;root;...;leaf count" per line,
+        readable by flamegraph.pl and speedscope.
+        """
+        lines = []
+        for (thread_name, stack), count in sorted(self.stacks.items()):
+            frames = [thread_name.replace(";", ":")]
+            frames.extend(_frame_label(frame_key) for frame_key in stack)
+            lines.append(f"{';'.join(frames)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self) -> dict:
+        frames, frame_indices, profiles = [], {}, {}
+        for (thread_name, stack), count in sorted(self.stacks.items()):
+            sample = []
+            for frame_key in stack:
+                if frame_key not in frame_indices:
+                    frame_indices[frame_key] = len(frames)
+                    frames.append(
+                        {
+                            "name": frame_key[0],
+                            "file": frame_key[1],
+                            "line": frame_key[2],
+                        }
+                    )
+                sample.append(frame_indices[frame_key])
+
+            if thread_name not in profiles:
+                profiles[thread_name] = {
+                    "type": "sampled",
+                    "name": thread_name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": self.duration,
+                    "samples": [],
+                    "weights": [],
+                }
+            profiles[thread_name]["samples"].append(sample)
+            profiles[thread_name]["weights"].append(count * self.interval)
+
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+            "name": f"facetrace profile ({self.sample_count} samples)",
+            "exporter": "facetrace",
+        }
+
+
+def check_profile_arguments(seconds: float, interval: float):
+    """
+    Raises ValueError unless the duration is positive and the interval is between
+    MIN_PROFILE_INTERVAL and MAX_PROFILE_SECONDS.
+    """
+    if not seconds > 0:
+        raise ValueError(f"profile seconds must be positive, got {seconds}")
+    if not MIN_PROFILE_INTERVAL <= interval <= MAX_PROFILE_SECONDS:
+        raise ValueError(
+            f"profile interval must be between {MIN_PROFILE_INTERVAL * 1000:g} ms "
+            f"and {MAX_PROFILE_SECONDS} s, got {interval * 1000:g} ms"
+        )
+
+
+def sample_threads(seconds: float, interval=0.01) -> Profile:
+    """
+    Samples the python stack of every thread (request handlers, store dump thread,
+    executor threads) every interval seconds for the given duration. Sampling only
+    reads sys._current_frames, the profiled threads are never interrupted.
+    Args:
+        seconds (float): profiling duration, capped to MAX_PROFILE_SECONDS
+        interval (float): seconds between two samples, at least MIN_PROFILE_INTERVAL
+    Returns:
+        profile (Profile): aggregated samples
+    """
+    check_profile_arguments(seconds, interval)
+    if not _profile_lock.acquire(blocking=False):
+        raise Exception("Another profile is already running")
+
+    try:
+        seconds = min(float(seconds), MAX_PROFILE_SECONDS)
+        profile = Profile(interval)
+        sampler_id = threading.get_ident()
+        start_time = time.perf_counter()
+        deadline = start_time + seconds
+        while time.perf_counter() < deadline:
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_key(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                profile.stacks[(thread_name, tuple(stack))] += 1
+            profile.sample_count += 1
+            time.sleep(interval)
+        profile.duration = time.perf_counter() - start_time
+        return profile
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,108 @@
+# Standard Imports
+import json
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Third Party Imports
+
+# Internal Imports
+
+slow_request_logger = logging.getLogger("facetrace.slow_requests")
+
+
+class Trace:
+    """
+    Request scoped collection of timed spans, spans with the same name (e.g. one
+    pnet span per image) are aggregated when rendered.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_time = time.perf_counter()
+        self.spans = []
+
+    def add(self, name: str, duration: float):
+        self.spans.append((name, duration))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    def aggregate(self) -> dict:
+        aggregated = {}
+        for name, duration in self.spans:
+            total, count = aggregated.get(name, (0.0, 0))
+            aggregated[name] = (total + duration, count + 1)
+        return aggregated
+
+    def server_timing(self) -> str:
+        """
+        Renders spans as a Server-Timing header value, durations in milliseconds.
+        """
+        metrics = [
+            f'{name};dur={round(total * 1000, 2)};desc="x{count}"'
+            for name, (total, count) in self.aggregate().items()
+        ]
+        metrics.append(f"total;dur={round(self.elapsed() * 1000, 2)}")
+        return ", ".join(metrics)
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "total_ms": round(self.elapsed() * 1000, 2),
+            "spans": {
+                name: {"total_ms": round(total * 1000, 2), "count": count}
+                for name, (total, count) in self.aggregate().items()
+            },
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def start_trace(name: str) -> Trace:
+    trace = Trace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """
+    Times the enclosed block into the current request trace, no-op outside a request.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start_time)
+
+
+def record_span(name: str, start_time: float):
+    """
+    Records a span started at start_time (time.perf_counter), for code paths where
+    wrapping the block in span() is not practical.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, time.perf_counter() - start_time)
+
+
+def log_slow_request(trace: Trace, threshold_ms: float, **extra):
+    total_ms = trace.elapsed() * 1000
+    if threshold_ms is None or total_ms < threshold_ms:
+        return
+    record = trace.to_json()
+    record.update(extra)
+    record["timestamp"] = time.time()
+    slow_request_logger.warning(json.dumps(record))
@@ -1,40 +1,91 @@
 # Standard Imports
+import os
 import time
 import json
 import pickle
+import hashlib
 import asyncio
+import inspect
 import logging
+import tracemalloc
 
 # Third Party Imports
 import yaml
 import numpy as np
 
 # Internal Imports
+from utils.metrics import (
+    current_endpoint,
+    STAGE_LATENCY,
+    STAGE_BATCH_SIZE,
+    STAGE_ERRORS,
+)
+
+
+def _argument_getter(method, names):
+    """
+    Returns a callable which fetches the first of given argument names from
+    (args, kwargs) of a call, without binding the full signature on every call.
+    """
+    parameters = list(inspect.signature(method).parameters)
+    positions = [(name, parameters.index(name)) for name in names if name in parameters]
+
+    def getter(args, kw):
+        for name, position in positions:
+            if name in kw:
+                return kw[name]
+            if position < len(args):
+                return args[position]
+        return None
+
+    return getter
 
 
 def timeit(method):
-    def timed(*args, **kw):
-        ts = time.time()
-        result = method(*args, **kw)
-        te = time.time()
+    stage = method.__name__
+    get_model = _argument_getter(
+        method, ["model_name", "embedding_name", "detector_name"]
+    )
+    get_inputs = _argument_getter(method, ["images", "image_tuples"])
+
+    def record(ts, te, args, kw, failed=False):
+        labels = {
+            "stage": stage,
+            "endpoint": current_endpoint.get(),
+            "model": get_model(args, kw) or "",
+        }
+        if failed:
+            STAGE_ERRORS.inc(**labels)
+            return
+        STAGE_LATENCY.observe(te - ts, **labels)
+        inputs = get_inputs(args, kw)
+        STAGE_BATCH_SIZE.observe(
+            len(inputs) if isinstance(inputs, list) else 1, **labels
+        )
         if "log_time" in kw:
             name = kw.get("log_name", method.__name__.upper())
             kw["log_time"][name] = int((te - ts) * 1000)
         else:
-            msg = "%r  %2.2f ms" % (method.__name__, (te - ts) * 1000)
-            logging.warning(msg)
+            logging.debug("%r  %2.2f ms" % (method.__name__, (te - ts) * 1000))
+
+    def timed(*args, **kw):
+        ts = time.perf_counter()
+        try:
+            result = method(*args, **kw)
+        except Exception:
+            record(ts, time.perf_counter(), args, kw, failed=True)
+            raise
+        record(ts, time.perf_counter(), args, kw)
         return result
 
     async def async_timed(*args, **kw):
-        ts = time.time()
-        result = await method(*args, **kw)
-        te = time.time()
-        if "log_time" in kw:
-            name = kw.get("log_name", method.__name__.upper())
-            kw["log_time"][name] = int((te - ts) * 1000)
-        else:
-            msg = "%r  %2.2f ms" % (method.__name__, (te - ts) * 1000)
-            logging.warning(msg)
+        ts = time.perf_counter()
+        try:
+            result = await method(*args, **kw)
+        except Exception:
+            record(ts, time.perf_counter(), args, kw, failed=True)
+            raise
+        record(ts, time.perf_counter(), args, kw)
         return result
 
     if asyncio.iscoroutinefunction(method):
@@ -70,10 +121,51 @@ def dump_pickle(data, path):
         pickle.dump(data, file)
 
 
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def normalize_vectors(vectors, **kwargs):
-    vectors = np.array(vectors, dtype=np.float32)
-    for i in range(0, len(vectors)):
-        if np.linalg.norm(vectors[i]) == 0:
-            continue
-        vectors[i] /= np.linalg.norm(vectors[i])
-    return np.array(vectors, dtype=kwargs.get("dtype", "float32"))
+    vectors = np.asarray(vectors, dtype=kwargs.get("dtype", "float32"))
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    # zero vectors are left untouched
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def process_rss_bytes():
+    """
+    Resident set size of the current process, None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def tracemalloc_top(limit=20, key_type="lineno"):
+    """
+    Top allocation sites of the live python heap, None when tracemalloc is not tracing
+    (enable with admin.tracemalloc_frames or PYTHONTRACEMALLOC).
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    statistics = tracemalloc.take_snapshot().statistics(key_type)
+    return {
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "top": [
+            {
+                "location": str(statistic.traceback[0]),
+                "size_bytes": statistic.size,
+                "count": statistic.count,
+            }
+            for statistic in statistics[:limit]
+        ],
+    }